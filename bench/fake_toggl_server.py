@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""ベンチマーク用のローカル Toggl Track API サーバー
+
+main.py が使うエンドポイントだけを実装し、遅延・エラー率・429 を設定して
+合成データに対するツールの挙動を本番APIに触れずに計測できるようにする。
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ベンチマークで使う固定のワークスペースIDとユーザーID
+WORKSPACE_ID = 1234567
+USER_ID = 1
+
+# 合成データで使うタグとディスクリプション
+SAMPLE_TAGS = ["meeting", "development", "research", "admin"]
+SAMPLE_DESCRIPTIONS = ["Standup", "Code review", "Implementation", "Planning", "Email", "Reading"]
+
+# エンドポイントをパスのパターンで分類する（統計の集計単位）
+ENDPOINT_PATTERNS = [
+    (re.compile(r'^/api/v9/me$'), 'me'),
+    (re.compile(r'^/api/v9/me/time_entries$'), 'me/time_entries'),
+    (re.compile(r'^/api/v9/workspaces/(\d+)$'), 'workspaces/{id}'),
+    (re.compile(r'^/api/v9/workspaces/(\d+)/projects$'), 'workspaces/{id}/projects'),
+    (re.compile(r'^/api/v9/workspaces/(\d+)/projects/(\d+)$'), 'workspaces/{id}/projects/{id}'),
+    (re.compile(r'^/api/v9/workspaces/(\d+)/tags$'), 'workspaces/{id}/tags'),
+    (re.compile(r'^/api/v9/workspaces/(\d+)/time_entries/([\d,]+)$'), 'workspaces/{id}/time_entries/{ids}'),
+]
+
+class Dataset:
+    """合成タイムエントリーの集合
+
+    100万件でも扱えるよう、エントリーは辞書ではなく列ごとの配列で保持する。
+    エントリーIDは 1 から始まる連番で、開始時刻の昇順に並んでいる。
+    """
+
+    def __init__(self, entries, projects, days, untagged_ratio=0.7, seed=0, archived_ratio=0.05):
+        rng = random.Random(seed)
+        now = time.time()
+        span = days * 24 * 60 * 60
+        first_start = now - span
+
+        self.projects = {project_id: f"Project {project_id}" for project_id in range(1, projects + 1)}
+        # 一部のプロジェクトはアーカイブ済みとして一覧に出さず、個別取得でのみ返す
+        self.archived = {project_id for project_id in self.projects if rng.random() < archived_ratio}
+
+        starts = sorted(first_start + rng.random() * span for _ in range(entries))
+        self.starts = array('d', starts)
+        self.updated_at = array('d', starts)
+        self.durations = array('l', (rng.randint(5, 180) * 60 for _ in range(entries)))
+        self.project_ids = array('l', (rng.randint(0, projects) for _ in range(entries)))
+        self.billable = array('b', (rng.random() < 0.5 for _ in range(entries)))
+        # タグ付きのエントリーのみ辞書で持つ（疎）
+        self.tags = {
+            entry_id: [rng.choice(SAMPLE_TAGS)]
+            for entry_id in range(1, entries + 1)
+            if rng.random() >= untagged_ratio
+        }
+        # ワークスペースのタグ一覧（名前 → タグID）
+        self.workspace_tags = {tag: tag_id for tag_id, tag in enumerate(SAMPLE_TAGS, 1)}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def entry(self, entry_id):
+        index = entry_id - 1
+        start = datetime.fromtimestamp(self.starts[index], timezone.utc)
+        project_id = self.project_ids[index] or None
+        return {
+            "id": entry_id,
+            "workspace_id": WORKSPACE_ID,
+            "user_id": USER_ID,
+            "project_id": project_id,
+            "description": SAMPLE_DESCRIPTIONS[entry_id % len(SAMPLE_DESCRIPTIONS)],
+            "start": start.isoformat().replace("+00:00", "Z"),
+            "stop": (start + timedelta(seconds=self.durations[index])).isoformat().replace("+00:00", "Z"),
+            "duration": self.durations[index],
+            "billable": bool(self.billable[index]),
+            "tags": self.tags.get(entry_id, []),
+            "tag_ids": [],
+            "project_name": self.projects.get(project_id) if project_id else None,
+            "client_name": None,
+            "at": datetime.fromtimestamp(self.updated_at[index], timezone.utc).isoformat().replace("+00:00", "Z"),
+            "server_deleted_at": None,
+        }
+
+    def ids_in_range(self, start, end):
+        first = bisect_left(self.starts, start)
+        last = bisect_right(self.starts, end)
+        return range(first + 1, last + 1)
+
+    def ids_updated_since(self, since):
+        return (entry_id for entry_id in range(1, len(self) + 1) if self.updated_at[entry_id - 1] >= since)
+
+    def exists(self, entry_id):
+        return 1 <= entry_id <= len(self)
+
+    def set_tags(self, entry_id, tags):
+        with self.lock:
+            if tags:
+                self.tags[entry_id] = list(tags)
+            else:
+                self.tags.pop(entry_id, None)
+            self.updated_at[entry_id - 1] = time.time()
+
+    def add_tags(self, entry_id, tags):
+        with self.lock:
+            current = self.tags.get(entry_id, [])
+            merged = current + [tag for tag in tags if tag not in current]
+        self.set_tags(entry_id, merged)
+
+class ServerStats:
+    """エンドポイントごとのリクエスト数と処理時間を記録する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.status_counts = {}
+
+    def record(self, endpoint, status, seconds):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            key = (endpoint, status)
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.latencies.clear()
+            self.status_counts.clear()
+
+    def summary(self):
+        """エンドポイントごとの件数と p50/p99 レイテンシ（ミリ秒）"""
+        with self.lock:
+            result = {}
+            for endpoint, values in sorted(self.latencies.items()):
+                ordered = sorted(values)
+                result[endpoint] = {
+                    "requests": len(ordered),
+                    "p50_ms": percentile(ordered, 50) * 1000,
+                    "p99_ms": percentile(ordered, 99) * 1000,
+                    "statuses": {
+                        str(status): count
+                        for (name, status), count in sorted(self.status_counts.items())
+                        if name == endpoint
+                    },
+                }
+            return result
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def parse_api_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+class FakeTogglHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # ヘッダーと本文を別々に書くため、Nagle アルゴリズムによる遅延を避ける
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def _dispatch(self, method):
+        started = time.perf_counter()
+        parsed = urlparse(self.path)
+        endpoint, match = 'unknown', None
+        for pattern, name in ENDPOINT_PATTERNS:
+            match = pattern.match(parsed.path)
+            if match:
+                endpoint = name
+                break
+        endpoint_key = f"{method} {endpoint}"
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        status = self._handle(method, endpoint, match, parse_qs(parsed.query), body)
+        self.server.stats.record(endpoint_key, status, time.perf_counter() - started)
+
+    def _handle(self, method, endpoint, match, query, body):
+        options = self.server.options
+        dataset = self.server.dataset
+
+        if options.latency_ms or options.jitter_ms:
+            time.sleep(max(0.0, options.latency_ms + random.uniform(-options.jitter_ms, options.jitter_ms)) / 1000)
+        if endpoint != 'unknown' and random.random() < options.rate_429:
+            return self._send_json(429, {"error": "Too Many Requests"}, {"Retry-After": str(options.retry_after)})
+        if endpoint != 'unknown' and random.random() < options.error_rate:
+            return self._send_json(503, {"error": "Service Unavailable"})
+
+        if method == 'GET' and endpoint == 'me':
+            return self._send_json(200, {
+                "id": USER_ID, "fullname": "Benchmark User", "email": "bench@example.com",
+                "default_workspace_id": WORKSPACE_ID,
+            })
+
+        if method == 'GET' and endpoint == 'workspaces/{id}':
+            if int(match.group(1)) != WORKSPACE_ID:
+                return self._send_json(404, {"error": "Not Found"})
+            return self._send_json(200, {"id": WORKSPACE_ID, "name": "Benchmark Workspace"})
+
+        if method == 'GET' and endpoint == 'workspaces/{id}/projects':
+            page = int(query.get('page', ['1'])[0])
+            per_page = int(query.get('per_page', ['50'])[0])
+            visible = [project_id for project_id in sorted(dataset.projects) if project_id not in dataset.archived]
+            page_ids = visible[(page - 1) * per_page:page * per_page]
+            return self._send_json(200, [{"id": project_id, "name": dataset.projects[project_id]} for project_id in page_ids])
+
+        if method == 'GET' and endpoint == 'workspaces/{id}/projects/{id}':
+            project_id = int(match.group(2))
+            if project_id not in dataset.projects:
+                return self._send_json(404, {"error": "Not Found"})
+            return self._send_json(200, {"id": project_id, "name": dataset.projects[project_id]})
+
+        if method == 'GET' and endpoint == 'workspaces/{id}/tags':
+            return self._send_json(200, [
+                {"id": tag_id, "name": name, "workspace_id": WORKSPACE_ID}
+                for name, tag_id in dataset.workspace_tags.items()
+            ])
+
+        if method == 'POST' and endpoint == 'workspaces/{id}/tags':
+            name = (json.loads(body or b'{}').get('name') or '').strip()
+            with dataset.lock:
+                if not name or name.casefold() in {tag.casefold() for tag in dataset.workspace_tags}:
+                    return self._send_json(400, "Tag already exists" if name else "Tag name must not be empty")
+                dataset.workspace_tags[name] = len(dataset.workspace_tags) + 1
+            return self._send_json(200, {"id": dataset.workspace_tags[name], "name": name, "workspace_id": WORKSPACE_ID})
+
+        if method == 'GET' and endpoint == 'me/time_entries':
+            if 'since' in query:
+                entry_ids = dataset.ids_updated_since(float(query['since'][0]))
+            else:
+                start = parse_api_time(query['start_date'][0]) if 'start_date' in query else 0
+                end = parse_api_time(query['end_date'][0]) if 'end_date' in query else time.time()
+                entry_ids = dataset.ids_in_range(start, end)
+            return self._send_entries(entry_ids)
+
+        if method == 'PUT' and endpoint == 'workspaces/{id}/time_entries/{ids}':
+            entry_id = int(match.group(2))
+            if not dataset.exists(entry_id):
+                return self._send_json(404, {"error": "Not Found"})
+            payload = json.loads(body or b'{}')
+            if 'tags' in payload:
+                dataset.set_tags(entry_id, payload['tags'])
+            return self._send_json(200, dataset.entry(entry_id))
+
+        if method == 'PATCH' and endpoint == 'workspaces/{id}/time_entries/{ids}':
+            entry_ids = [int(entry_id) for entry_id in match.group(2).split(',')]
+            if len(entry_ids) > 100:
+                return self._send_json(400, {"error": "Too many ids"})
+            operations = json.loads(body or b'[]')
+            success, failure = [], []
+            for entry_id in entry_ids:
+                if not dataset.exists(entry_id):
+                    failure.append({"id": entry_id, "message": "Time entry not found"})
+                    continue
+                for operation in operations:
+                    if operation.get('path') != '/tags':
+                        continue
+                    if operation.get('op') == 'add':
+                        dataset.add_tags(entry_id, operation.get('value') or [])
+                    elif operation.get('op') == 'replace':
+                        dataset.set_tags(entry_id, operation.get('value') or [])
+                    elif operation.get('op') == 'remove':
+                        dataset.set_tags(entry_id, [])
+                success.append(entry_id)
+            return self._send_json(200, {"success": success, "failure": failure})
+
+        return self._send_json(404, {"error": "Not Found"})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return status
+
+    def _send_entries(self, entry_ids):
+        """大量のエントリーをメモリに溜めずにチャンク転送で返す"""
+        dataset = self.server.dataset
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        buffer = ['[']
+        size = 1
+        first = True
+        for entry_id in entry_ids:
+            item = json.dumps(dataset.entry(entry_id))
+            buffer.append(item if first else ',' + item)
+            size += len(item) + 1
+            first = False
+            if size >= 64 * 1024:
+                self._write_chunk(''.join(buffer))
+                buffer, size = [], 0
+        buffer.append(']')
+        self._write_chunk(''.join(buffer))
+        self.wfile.write(b'0\r\n\r\n')
+        return 200
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+class FakeTogglServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dataset, options):
+        super().__init__(address, FakeTogglHandler)
+        self.dataset = dataset
+        self.options = options
+        self.stats = ServerStats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v9"
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+def add_server_arguments(parser):
+    """サーバーの挙動とデータセットに関する引数を追加する（ベンチマークスクリプトと共用）"""
+    parser.add_argument('--entries', type=int, default=10000, help='合成タイムエントリー数 (デフォルト: 10000)')
+    parser.add_argument('--projects', type=int, default=200, help='プロジェクト数 (デフォルト: 200)')
+    parser.add_argument('--days', type=int, default=30, help='エントリーを分布させる日数 (デフォルト: 30)')
+    parser.add_argument('--untagged-ratio', type=float, default=0.7, help='タグ未設定エントリーの割合 (デフォルト: 0.7)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='各リクエストに加える遅延（ミリ秒）')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='遅延のばらつき（ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='503 を返す確率 (0-1)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='429 を返す確率 (0-1)')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='429 の Retry-After 秒数')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+
+def create_server(options, host='127.0.0.1', port=0):
+    random.seed(options.seed)
+    dataset = Dataset(options.entries, options.projects, options.days, options.untagged_ratio, options.seed)
+    return FakeTogglServer((host, port), dataset, options)
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用のローカル Toggl Track API サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_server_arguments(parser)
+    options = parser.parse_args()
+
+    server = create_server(options, options.host, options.port)
+    print(f"🧪 Fake Toggl API listening on {server.base_url} ({len(server.dataset)} entries, workspace {WORKSPACE_ID})")
+    print(f"   TOGGL_API_BASE_URL={server.base_url} WORKSPACE_ID={WORKSPACE_ID}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""署名付きの Toggl Webhook イベントをローカルの受信サーバーに再送する
+
+本番の Webhook サブスクリプションを作らずに main.py --webhook の動作を確認するためのツール。
+イベントは JSON Lines ファイル（Webhook イベントまたはタイムエントリーそのもの）か、
+Toggl API（ローカルの fake_toggl_server.py でもよい）から取得したエントリーをもとに作る。
+
+使用例:
+  python bench/replay_webhook_events.py --events events.jsonl
+  python bench/replay_webhook_events.py --api-base-url http://127.0.0.1:8766/api/v9 --days 2 --repeat 3
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from base64 import b64encode
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_RECEIVER_URL = 'http://127.0.0.1:8780/'
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='署名付きの Toggl Webhook イベントをローカルの受信サーバーに再送します。')
+    parser.add_argument('--url', default=DEFAULT_RECEIVER_URL, help=f'受信サーバーのURL (デフォルト: {DEFAULT_RECEIVER_URL})')
+    parser.add_argument('--secret', default=os.getenv('TOGGL_WEBHOOK_SECRET'),
+                        help='署名に使うシークレット (デフォルト: 環境変数 TOGGL_WEBHOOK_SECRET)')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--events', metavar='PATH', help='Webhook イベントまたはタイムエントリーの JSON Lines ファイル')
+    source.add_argument('--api-base-url', metavar='URL', help='エントリーを取得する Toggl API のベースURL')
+    parser.add_argument('--token', default=os.getenv('TOGGL_API_TOKEN', 'replay-token'),
+                        help='--api-base-url 使用時のAPIトークン (デフォルト: 環境変数 TOGGL_API_TOKEN)')
+    parser.add_argument('--days', type=int, default=1, help='--api-base-url 使用時に取得する日数 (デフォルト: 1)')
+    parser.add_argument('--repeat', type=int, default=1, help='各イベントを送る回数（デバウンスの確認用）')
+    parser.add_argument('--rate', type=float, default=0, help='1秒あたりの送信数。0で無制限')
+    parser.add_argument('--drop-ratio', type=float, default=0,
+                        help='送らずに捨てるイベントの割合（取りこぼしと差分同期の確認用）')
+    parser.add_argument('--bad-signature', action='store_true', help='わざと不正な署名で送る')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード')
+    options = parser.parse_args()
+    if not options.secret:
+        parser.error('--secret または環境変数 TOGGL_WEBHOOK_SECRET を指定してください')
+    return options
+
+def wrap_entry(entry, event_id):
+    """タイムエントリーを time_entry の updated イベントの形にする"""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "event_id": event_id,
+        "created_at": now,
+        "creator_id": entry.get('user_id', 0),
+        "metadata": {
+            "action": "updated",
+            "model": "time_entry",
+            "workspace_id": entry.get('workspace_id'),
+            "time_entry_id": entry['id'],
+        },
+        "payload": entry,
+        "subscription_id": 0,
+        "timestamp": now,
+    }
+
+def load_events(path):
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            events.append(record if 'payload' in record else wrap_entry(record, len(events) + 1))
+    return events
+
+def fetch_events(base_url, token, days):
+    """API から直近のエントリーを取得してイベントにする"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=days)
+    query = f"start_date={start.strftime('%Y-%m-%dT%H:%M:%SZ')}&end_date={end.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+    request = urllib.request.Request(f"{base_url.rstrip('/')}/me/time_entries?{query}")
+    request.add_header('Authorization', f"Basic {b64encode(f'{token}:api_token'.encode()).decode()}")
+    with urllib.request.urlopen(request) as response:
+        entries = json.load(response)
+    return [wrap_entry(entry, index) for index, entry in enumerate(entries, 1)]
+
+def send_event(url, secret, event, bad_signature=False):
+    """イベントを署名付きで送り、ステータスコードを返す（接続できなければ "error"）"""
+    body = json.dumps(event).encode()
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    if bad_signature:
+        signature = signature[::-1]
+    request = urllib.request.Request(url, data=body, method='POST')
+    request.add_header('Content-Type', 'application/json')
+    request.add_header('X-Webhook-Signature-256', f"sha256={signature}")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except urllib.error.URLError:
+        return 'error'
+
+def main():
+    options = parse_arguments()
+    rng = random.Random(options.seed)
+
+    events = load_events(options.events) if options.events else fetch_events(options.api_base_url, options.token, options.days)
+    print(f"📡 Replaying {len(events)} events x{options.repeat} to {options.url}")
+
+    statuses = {}
+    dropped = 0
+    interval = 1 / options.rate if options.rate > 0 else 0
+    started = time.perf_counter()
+    for _ in range(options.repeat):
+        for event in events:
+            if options.drop_ratio and rng.random() < options.drop_ratio:
+                dropped += 1
+                continue
+            status = send_event(options.url, options.secret, event, options.bad_signature)
+            statuses[status] = statuses.get(status, 0) + 1
+            if interval:
+                time.sleep(interval)
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Sent {sum(statuses.values())} events in {elapsed:.2f}s ({dropped} dropped on purpose)")
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"   {status}: {count}")
+    sys.exit(1 if 'error' in statuses else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""ローカルの Toggl API スタンドインに対して main.py を実行し、スループットを計測する
+
+使用例:
+  python bench/run_benchmark.py --entries 100000 --days 30
+  python bench/run_benchmark.py --entries 10000 --latency-ms 50 --rate-429 0.01 -- --async
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_toggl_server import WORKSPACE_ID, add_server_arguments, create_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(REPO_ROOT, 'main.py')
+
+# ベンチマークではレート制限を外してツール自体の処理速度を測る
+DEFAULT_FIXER_ARGS = ['--rate-limit', '0', '--no-cache']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='ローカルの Toggl API スタンドインに対して main.py を実行し、スループットを計測します。',
+        epilog='"--" 以降の引数はそのまま main.py に渡されます。'
+    )
+    add_server_arguments(parser)
+    parser.add_argument('--json', metavar='PATH', help='結果をJSONファイルにも書き出す')
+    parser.add_argument('--dry-run', action='store_true', help='main.py を --dry-run で実行する')
+
+    argv = sys.argv[1:]
+    fixer_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, fixer_args = argv[:split], argv[split + 1:]
+    options = parser.parse_args(argv)
+    options.fixer_args = fixer_args
+    return options
+
+def write_config(work_dir, dataset):
+    """全プロジェクトにタグを割り当てる config.json を作業ディレクトリに用意する"""
+    config = {name: [f"tag-{project_id % 10}"] for project_id, name in dataset.projects.items()}
+    with open(os.path.join(work_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+
+def run_fixer(work_dir, base_url, options):
+    """main.py を子プロセスとして実行し、(終了コード, 経過秒数, 最大RSS[KB], 出力) を返す"""
+    env = dict(os.environ)
+    env.update({
+        'TOGGL_API_TOKEN': 'benchmark-token',
+        'WORKSPACE_ID': str(WORKSPACE_ID),
+        'TIMEZONE': 'UTC',
+        'TOGGL_API_BASE_URL': base_url,
+    })
+    args = [sys.executable, MAIN_SCRIPT, '--days', str(options.days + 1)] + DEFAULT_FIXER_ARGS + options.fixer_args
+    if options.dry_run:
+        args.append('--dry-run')
+
+    started = time.perf_counter()
+    process = subprocess.Popen(args, cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # Linux は KB、macOS はバイト単位で返る
+    peak_rss_kb = rusage.ru_maxrss / 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return process.returncode, elapsed, peak_rss_kb, output.decode(errors='replace')
+
+def print_report(result):
+    print(f"\n{'='*72}")
+    print(f"📊 Benchmark: {result['entries']} entries / {result['days']} days / {result['projects']} projects")
+    print(f"{'='*72}")
+    print(f"   Exit code:        {result['exit_code']}")
+    print(f"   Wall time:        {result['wall_time_s']:.2f}s")
+    print(f"   Peak RSS:         {result['peak_rss_mb']:.1f} MB")
+    print(f"   Requests issued:  {result['requests']}")
+    print(f"   Entries tagged:   {result['entries_tagged']}")
+    print()
+    print(f"   {'Endpoint':<48} {'Count':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for endpoint, stats in result['endpoints'].items():
+        print(f"   {endpoint:<48} {stats['requests']:>7} {stats['p50_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+def main():
+    options = parse_arguments()
+
+    print(f"🧪 Generating {options.entries} synthetic entries...")
+    server = create_server(options)
+    server.start_in_background()
+    tagged_before = len(server.dataset.tags)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            write_config(work_dir, server.dataset)
+            print(f"🚀 Running main.py against {server.base_url}")
+            exit_code, elapsed, peak_rss_kb, output = run_fixer(work_dir, server.base_url, options)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    endpoints = server.stats.summary()
+    result = {
+        "entries": options.entries,
+        "days": options.days,
+        "projects": options.projects,
+        "fixer_args": DEFAULT_FIXER_ARGS + options.fixer_args,
+        "exit_code": exit_code,
+        "wall_time_s": elapsed,
+        "peak_rss_mb": peak_rss_kb / 1024,
+        "requests": sum(stats['requests'] for stats in endpoints.values()),
+        "entries_tagged": len(server.dataset.tags) - tagged_before,
+        "endpoints": endpoints,
+    }
+
+    if exit_code != 0:
+        print(output[-4000:])
+    print_report(result)
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n📝 Result saved to: {options.json}")
+
+    sys.exit(1 if exit_code != 0 else 0)
+
+if __name__ == "__main__":
+    main()
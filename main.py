@@ -2,13 +2,44 @@
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 import time
+import re
+import gzip
+import shutil
+import hashlib
+import asyncio
+import threading
+import sys
+import io
+import contextvars
+import codecs
+import hmac
+import queue
+import signal
+import sqlite3
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from base64 import b64encode
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
 
+# Toggl Track API のベースURL（ベンチマーク用のローカルサーバーなどに差し替え可能）
+DEFAULT_API_BASE_URL = 'https://api.track.toggl.com/api/v9'
+# .env を読み込んだ後に main() で TOGGL_API_BASE_URL の値に置き換える
+API_BASE_URL = DEFAULT_API_BASE_URL
+
+def configure_api_base_url():
+    """TOGGL_API_BASE_URL（.env も含む）から接続先のAPIを設定する"""
+    global API_BASE_URL
+    API_BASE_URL = os.getenv('TOGGL_API_BASE_URL', DEFAULT_API_BASE_URL).rstrip('/')
+
 def parse_arguments():
     """コマンドライン引数を解析する"""
     parser = argparse.ArgumentParser(
@@ -21,6 +52,7 @@ def parse_arguments():
   %(prog)s --today            # 今日のエントリーを処理
   %(prog)s --dry-run          # 実際に更新せずに確認
   %(prog)s --interactive      # 対話的にタグを選択
+  %(prog)s report             # ローカルミラーから統計レポートを表示
         '''
     )
     
@@ -49,6 +81,22 @@ def parse_arguments():
         help='過去N日分を処理',
         metavar='N'
     )
+    date_group.add_argument(
+        '--incremental',
+        action='store_true',
+        help='前回の同期以降に作成・更新されたエントリーのみを処理'
+    )
+    date_group.add_argument(
+        '--resume',
+        action='store_true',
+        help='中断された前回の実行を、未完了の日付から再開する'
+    )
+    date_group.add_argument(
+        '--undo',
+        type=str,
+        help='指定した実行で追加したタグを、変更前の状態に戻す',
+        metavar='RUN_ID'
+    )
     
     # その他のオプション
     parser.add_argument(
@@ -63,18 +111,415 @@ def parse_arguments():
         help='対話的にタグを選択・編集する'
     )
     
+    parser.add_argument(
+        '--no-create-tags',
+        action='store_true',
+        help='ワークスペースにないタグを作成せず、エラーとして終了する'
+    )
+    
+    # キャッシュ関連オプション
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='プロジェクト・ワークスペース情報の永続キャッシュを使用しない'
+    )
+    cache_group.add_argument(
+        '--refresh-cache',
+        action='store_true',
+        help='保存済みのキャッシュを破棄して最新の情報を取得し直す'
+    )
+    
+    # 並行処理オプション
+    parser.add_argument(
+        '--async',
+        dest='async_mode',
+        action='store_true',
+        help='プロジェクト情報の取得とタグ更新を並行して実行する'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'--async 使用時の同時リクエスト数の上限 (デフォルト: {DEFAULT_CONCURRENCY})',
+        metavar='N'
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help=f'1秒あたりの最大リクエスト数。0で無制限 (デフォルト: {DEFAULT_RATE_LIMIT})',
+        metavar='N'
+    )
+    
+    # フリートモード
+    parser.add_argument(
+        '--fleet',
+        type=str,
+        help='マニフェストに記載された複数ユーザー・ワークスペースをまとめて処理する',
+        metavar='MANIFEST'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_FLEET_WORKERS,
+        help=f'--fleet 使用時に同時に処理するユーザー数 (デフォルト: {DEFAULT_FLEET_WORKERS})',
+        metavar='N'
+    )
+    
+    # 常駐モード
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='プロセスを常駐させ、一定間隔で変更されたエントリーを処理し続ける'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        help=f'--daemon 使用時のポーリング間隔（秒） (デフォルト: {DEFAULT_DAEMON_INTERVAL:g}、'
+             f'--webhook 使用時は {DEFAULT_RECONCILE_INTERVAL:g})',
+        metavar='SECONDS'
+    )
+    parser.add_argument(
+        '--webhook',
+        action='store_true',
+        help='Toggl Webhook を受信してリアルタイムにタグを付ける（--daemon として動作し、定期的に取りこぼしを確認する）'
+    )
+    parser.add_argument(
+        '--webhook-host',
+        type=str,
+        default=DEFAULT_WEBHOOK_HOST,
+        help=f'Webhook受信サーバーの待ち受けアドレス (デフォルト: {DEFAULT_WEBHOOK_HOST})',
+        metavar='HOST'
+    )
+    parser.add_argument(
+        '--webhook-port',
+        type=int,
+        default=DEFAULT_WEBHOOK_PORT,
+        help=f'Webhook受信サーバーのポート (デフォルト: {DEFAULT_WEBHOOK_PORT})',
+        metavar='PORT'
+    )
+    
+    # 計測オプション
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help=f'フェーズ・HTTP呼び出しごとの所要時間を表示し、メトリクスを保存する (デフォルト: {DEFAULT_METRICS_PATH})'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        type=str,
+        help='メトリクスの保存先。拡張子が .prom なら Prometheus textfile 形式、それ以外はJSON',
+        metavar='PATH'
+    )
+    
+    # サブコマンド（指定しなければ通常のタグ付けを行う）
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    report_parser = subparsers.add_parser(
+        'report',
+        help='ローカルミラーからタグ付け統計レポートを作成する（APIは呼び出さない）',
+        description='これまでに取得したエントリーのローカルミラーから、プロジェクト別・タグ別の作業時間とタグ付け率を集計します。'
+    )
+    report_parser.add_argument(
+        '--from',
+        dest='from_date',
+        type=str,
+        help=f'集計の開始日 (デフォルト: {DEFAULT_REPORT_DAYS}日前)',
+        metavar='YYYY-MM-DD'
+    )
+    report_parser.add_argument(
+        '--to',
+        dest='to_date',
+        type=str,
+        help='集計の終了日 (デフォルト: 今日)',
+        metavar='YYYY-MM-DD'
+    )
+    report_parser.add_argument(
+        '--period',
+        choices=['day', 'week', 'month'],
+        default='month',
+        help='タグ付け率の推移を集計する単位 (デフォルト: month)'
+    )
+    report_parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='プロジェクト別・タグ別に表示する件数 (デフォルト: 10)',
+        metavar='N'
+    )
+    report_parser.add_argument(
+        '--json',
+        type=str,
+        help='集計結果をJSONファイルにも書き出す',
+        metavar='PATH'
+    )
+    
     return parser.parse_args()
 
-def make_request_with_retry(method, url, headers, max_retries=3, **kwargs):
-    """リトライ機能付きのHTTPリクエスト"""
-    for attempt in range(max_retries):
+# --async 使用時の同時リクエスト数のデフォルト
+DEFAULT_CONCURRENCY = 4
+
+# 対応しているHTTPメソッド
+SUPPORTED_HTTP_METHODS = {'GET', 'POST', 'PUT', 'PATCH'}
+
+# 全リクエストで共有するHTTPセッション（接続をキープアライブで再利用する）
+_http_session = None
+
+def configure_http_session(pool_size=DEFAULT_CONCURRENCY, session=None):
+    """共有HTTPセッションを設定する
+
+    session を渡すとそのセッションを使う（テストやベンチマーク用の差し替え）。
+    """
+    global _http_session
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, DEFAULT_CONCURRENCY))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    _http_session = session
+    return session
+
+def get_http_session():
+    """共有HTTPセッションを返す。未設定なら作成する"""
+    if _http_session is None:
+        configure_http_session()
+    return _http_session
+
+def run_concurrently(func, items, concurrency):
+    """func(item) を最大 concurrency 件ずつ並行実行し、items と同じ順序で結果を返す
+
+    requests は同期APIなので、asyncio からスレッドに逃がして実行する。
+    """
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(item):
+            async with semaphore:
+                return await asyncio.to_thread(func, item)
+
+        return await asyncio.gather(*(run_one(item) for item in items))
+
+    return asyncio.run(run_all())
+
+# Toggl APIへのリクエストレートのデフォルト（1秒あたりのリクエスト数）
+DEFAULT_RATE_LIMIT = 1.0
+
+# レート制限時に連続で許容するバースト数
+RATE_LIMIT_BURST = 3
+
+# 429 Too Many Requests を受けたときの最大リトライ回数
+RATE_LIMIT_MAX_RETRIES = 5
+
+class RateLimiter:
+    """全APIリクエストが通過するトークンバケット方式のスケジューラ
+
+    設定レートでリクエストを送り出し、レスポンスのクォータヘッダーや
+    429 の Retry-After を見てペースを調整する。複数スレッドから同時に使える。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=RATE_LIMIT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_slot = 0.0        # 次のリクエストが理論上送れる時刻（monotonic）
+        self.paused_until = 0.0     # 429やクォータ切れで全体を止める期限
+        self.quota_interval = 0.0   # クォータヘッダーから算出した最小間隔
+        self.throttled_seconds = 0.0
+        self.rate_limited_count = 0
+
+    def _interval(self):
+        base_interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        return max(base_interval, self.quota_interval)
+
+    def acquire(self):
+        """送信枠を1つ予約し、必要なら枠が空くまで待つ"""
+        with self.lock:
+            now = time.monotonic()
+            interval = self._interval()
+            next_slot = max(self.next_slot, now)
+            # バースト分だけ前倒しで送信を許可する
+            send_at = max(next_slot - interval * (self.burst - 1), self.paused_until, now)
+            self.next_slot = max(next_slot, send_at) + interval
+            wait_time = send_at - now
+            self.throttled_seconds += wait_time
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def observe(self, response):
+        """レスポンスのクォータヘッダーから送信ペースを調整する"""
+        remaining = response.headers.get('X-Toggl-Quota-Remaining')
+        resets_in = response.headers.get('X-Toggl-Quota-Resets-In')
+        if remaining is None or resets_in is None:
+            return
         try:
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=headers, **kwargs)
-            elif method.upper() == 'PUT':
-                response = requests.put(url, headers=headers, **kwargs)
+            remaining = int(remaining)
+            resets_in = float(resets_in)
+        except ValueError:
+            return
+
+        with self.lock:
+            if remaining <= 0:
+                self.paused_until = max(self.paused_until, time.monotonic() + resets_in)
+                self.quota_interval = 0.0
             else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
+                # 残りのクォータをリセットまでの時間に均等に割り振る
+                self.quota_interval = resets_in / remaining
+
+    def pause_for_rate_limit(self, response, retry_count):
+        """429を受けたときに全体の送信を止め、待機秒数を返す"""
+        wait_time = parse_retry_after(response.headers.get('Retry-After'))
+        if wait_time is None:
+            wait_time = 2 ** retry_count  # Retry-After がなければ指数バックオフ
+        with self.lock:
+            self.rate_limited_count += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + wait_time)
+        return wait_time
+
+def parse_retry_after(value):
+    """Retry-After ヘッダー（秒数またはHTTP日付）を待機秒数に変換する"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=ZoneInfo("UTC"))
+    return max((retry_at - datetime.now(ZoneInfo("UTC"))).total_seconds(), 0.0)
+
+# APIトークンごとのレートリミッター（レート制限はトークン単位でかかる）
+_rate_limiters = {}
+_rate_limiter_settings = {"rate": DEFAULT_RATE_LIMIT, "burst": RATE_LIMIT_BURST}
+_rate_limiters_lock = threading.Lock()
+
+def configure_rate_limiter(rate=DEFAULT_RATE_LIMIT, burst=RATE_LIMIT_BURST):
+    """レートリミッターの設定を変更し、既存のリミッターを破棄する"""
+    with _rate_limiters_lock:
+        _rate_limiter_settings.update(rate=rate, burst=burst)
+        _rate_limiters.clear()
+
+def get_rate_limiter(token_key=None):
+    """トークンに対応するレートリミッターを返す。未作成なら作成する"""
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(token_key)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(**_rate_limiter_settings)
+            _rate_limiters[token_key] = rate_limiter
+        return rate_limiter
+
+def rate_limit_totals():
+    """全トークン分の (待機秒数の合計, 429を受けた回数の合計)"""
+    with _rate_limiters_lock:
+        limiters = list(_rate_limiters.values())
+    return (sum(limiter.throttled_seconds for limiter in limiters),
+            sum(limiter.rate_limited_count for limiter in limiters))
+
+# 計測用に API パスのIDをまとめるパターン（/projects/123 → /projects/{id}）
+ENDPOINT_ID_PATTERN = re.compile(r'/\d+(?:,\d+)*(?=/|$)')
+
+class RunMetrics:
+    """実行中の処理時間・HTTP呼び出し・リトライ・キャッシュの統計を集計する
+
+    フェーズは span() で囲んだ区間の回数と所要時間、HTTP はエンドポイントごとの
+    回数・所要時間・ステータスを記録する。複数スレッドから呼ばれるのでロックで保護する。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.phases = {}
+        self.http = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, time.perf_counter() - started)
+
+    def add_timing(self, phase, elapsed):
+        """span() で囲めない区間の所要時間をフェーズに加える"""
+        self._add_timing(self.phases, phase, elapsed)
+
+    def record_http(self, method, url, elapsed, status):
+        """HTTP呼び出し1回分を記録する（status はステータスコードか "error"）"""
+        path = url[len(API_BASE_URL):] if url.startswith(API_BASE_URL) else url
+        endpoint = f"{method} {ENDPOINT_ID_PATTERN.sub('/{id}', path.split('?')[0])}"
+        stats = self._add_timing(self.http, endpoint, elapsed)
+        with self._lock:
+            stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def _add_timing(self, table, key, elapsed):
+        with self._lock:
+            stats = table.setdefault(key, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "statuses": {}})
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            return stats
+
+    def snapshot(self):
+        """現時点の統計を辞書で返す（レート制限の待機時間も含める）"""
+        throttled_seconds, rate_limited_count = rate_limit_totals()
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "wall_seconds": time.time() - self.started_at,
+                "phases": {
+                    name: {key: value for key, value in stats.items() if key != 'statuses'}
+                    for name, stats in self.phases.items()
+                },
+                "http": {name: dict(stats, statuses=dict(stats['statuses'])) for name, stats in self.http.items()},
+                "counters": dict(
+                    self.counters,
+                    throttled_seconds=throttled_seconds,
+                    rate_limited_responses=rate_limited_count
+                ),
+            }
+
+_metrics = RunMetrics()
+
+def get_metrics():
+    return _metrics
+
+def make_request_with_retry(method, url, headers, max_retries=3, **kwargs):
+    """リトライ・レート制限対応のHTTPリクエスト"""
+    if method.upper() not in SUPPORTED_HTTP_METHODS:
+        raise ValueError(f"Unsupported HTTP method: {method}")
+
+    session = get_http_session()
+    rate_limiter = get_rate_limiter(headers.get('Authorization'))
+    metrics = get_metrics()
+    attempt = 0
+    rate_limit_retries = 0
+    while attempt < max_retries:
+        rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.request(method.upper(), url, headers=headers, **kwargs)
+            metrics.record_http(method.upper(), url, time.perf_counter() - started, response.status_code)
+            rate_limiter.observe(response)
+            
+            # レート制限（429）の場合は指定された時間だけ全体を止めてからリトライ
+            if response.status_code == 429 and rate_limit_retries < RATE_LIMIT_MAX_RETRIES:
+                rate_limit_retries += 1
+                metrics.increment('rate_limit_retries')
+                wait_time = rate_limiter.pause_for_rate_limit(response, rate_limit_retries)
+                response.close()  # stream=True のときに接続をプールへ戻す
+                print(f"⏳ Rate limited (429), waiting {wait_time:.1f}s... (retry {rate_limit_retries}/{RATE_LIMIT_MAX_RETRIES})")
+                continue
             
             # 成功またはクライアントエラー（4xx）の場合はリトライしない
             if response.status_code < 500:
@@ -84,19 +529,178 @@ def make_request_with_retry(method, url, headers, max_retries=3, **kwargs):
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt  # 指数バックオフ
                 print(f"⏳ Server error {response.status_code}, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
+                response.close()
+                metrics.increment('retries')
+                metrics.increment('backoff_seconds', wait_time)
                 time.sleep(wait_time)
             
         except requests.exceptions.RequestException as e:
+            metrics.record_http(method.upper(), url, time.perf_counter() - started, 'error')
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt
                 print(f"⏳ Network error: {e}, retrying in {wait_time}s... (attempt {attempt + 1}/{max_retries})")
+                metrics.increment('retries')
+                metrics.increment('backoff_seconds', wait_time)
                 time.sleep(wait_time)
             else:
                 print(f"❌ Network error after {max_retries} attempts: {e}")
                 raise
+        attempt += 1
     
     return response
 
+# メタデータキャッシュの保存先
+METADATA_CACHE_PATH = os.path.join("cache", "metadata_cache.json")
+
+# メタデータキャッシュの種類ごとの有効期間（秒）
+CACHE_TTL_SECONDS = {
+    "me": 60 * 60,
+    "workspace": 60 * 60,
+    "projects": 60 * 60,
+    "project": 24 * 60 * 60,
+    "tags": 60 * 60,
+}
+
+# 種類ごとにキャッシュへ保存するフィールド（/me の api_token などをディスクに残さない）
+CACHE_STORED_FIELDS = {
+    "me": ("id", "fullname", "email", "default_workspace_id"),
+}
+
+# 有効期間切れ後も再検証用に保持する期間（秒）。これを過ぎたレコードは削除する
+CACHE_STALE_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+class MetadataCache:
+    """プロジェクト名・ワークスペース情報・タグ一覧・/me の結果を保存する永続キャッシュ
+
+    レコードは種類ごとの有効期間を持ち、期限切れ後は ETag があれば条件付きリクエストで再検証する。
+    """
+
+    def __init__(self, path, refresh=False):
+        self.path = path
+        self.records = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        if not refresh:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.records = data.get('records', {})
+            for record_key, record in self.records.items():
+                # 以前のバージョンが保存した不要なフィールドを取り除く
+                kind = record_key.split(':', 1)[0]
+                value = self._stored_value(kind, record['value'])
+                if value != record['value']:
+                    record['value'] = value
+                    self.dirty = True
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, AttributeError):
+            print(f"⚠️  Warning: Ignoring corrupted cache file {self.path}")
+            self.records = {}
+
+    @staticmethod
+    def _stored_value(kind, value):
+        fields = CACHE_STORED_FIELDS.get(kind)
+        if fields is None or not isinstance(value, dict):
+            return value
+        return {field: value.get(field) for field in fields}
+
+    def _is_fresh(self, record, kind):
+        return time.time() - record['fetched_at'] < CACHE_TTL_SECONDS[kind]
+
+    def get(self, kind, key):
+        """有効期間内のレコードの値を返す。なければ None"""
+        record = self.records.get(f"{kind}:{key}")
+        if record is not None and self._is_fresh(record, kind):
+            self.hits += 1
+            get_metrics().increment('metadata_cache_hits')
+            return record['value']
+        self.misses += 1
+        get_metrics().increment('metadata_cache_misses')
+        return None
+
+    def get_etag(self, kind, key):
+        """期限切れレコードの再検証に使う ETag を返す"""
+        record = self.records.get(f"{kind}:{key}")
+        return record.get('etag') if record else None
+
+    def put(self, kind, key, value, etag=None):
+        self.records[f"{kind}:{key}"] = {
+            "value": self._stored_value(kind, value),
+            "etag": etag,
+            "fetched_at": time.time()
+        }
+        self.dirty = True
+
+    def invalidate(self, kind, key):
+        """レコードを削除し、次回は取得し直すようにする"""
+        if self.records.pop(f"{kind}:{key}", None) is not None:
+            self.dirty = True
+
+    def touch(self, kind, key):
+        """304 Not Modified を受け取ったレコードの有効期間を延長し、値を返す"""
+        record = self.records[f"{kind}:{key}"]
+        record['fetched_at'] = time.time()
+        self.dirty = True
+        return record['value']
+
+    def save(self):
+        """古すぎるレコードを削除してからファイルに書き出す"""
+        now = time.time()
+        for record_key in list(self.records):
+            kind = record_key.split(':', 1)[0]
+            ttl = CACHE_TTL_SECONDS.get(kind, 0)
+            if now - self.records[record_key]['fetched_at'] > ttl + CACHE_STALE_RETENTION_SECONDS:
+                del self.records[record_key]
+                self.dirty = True
+
+        if not self.dirty:
+            return
+
+        write_json_atomic(self.path, {"records": self.records})
+        self.dirty = False
+
+def write_json_atomic(path, data):
+    """一時ファイルに書いてから置き換えることで、途中で落ちても壊れないようにJSONを保存する"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def cached_get_json(metadata_cache, kind, key, url, auth_header, **kwargs):
+    """キャッシュを考慮してGETし、(レスポンス, JSONデータ) を返す
+
+    キャッシュが有効なら通信せずに (None, データ) を返す。
+    取得に失敗した場合は (レスポンス, None) を返すので、呼び出し側でステータスを確認する。
+    """
+    if metadata_cache is None:
+        response = make_request_with_retry('GET', url, auth_header, **kwargs)
+        return response, response.json() if response.status_code == 200 else None
+
+    value = metadata_cache.get(kind, key)
+    if value is not None:
+        return None, value
+
+    headers = dict(auth_header)
+    etag = metadata_cache.get_etag(kind, key)
+    if etag:
+        headers['If-None-Match'] = etag
+
+    response = make_request_with_retry('GET', url, headers, **kwargs)
+    if response.status_code == 304 and etag:
+        return response, metadata_cache.touch(kind, key)
+    if response.status_code != 200:
+        return response, None
+
+    data = response.json()
+    metadata_cache.put(kind, key, data, response.headers.get('ETag'))
+    return response, data
+
 def validate_config_file(config_path):
     """config.jsonの検証"""
     try:
@@ -120,7 +724,18 @@ def validate_config_file(config_path):
         return True, {}
     
     # プロジェクト名とタグの検証
+    rule_count = 0
     for project_name, tags in config.items():
+        # "rules" キーのオブジェクト配列は条件付きルールとして検証する
+        if is_rules_section(project_name, tags):
+            for index, rule in enumerate(tags, 1):
+                error = validate_rule(rule)
+                if error:
+                    print(f"❌ Error: Invalid rule #{index} in {config_path}: {error}")
+                    return False, {}
+            rule_count = len(tags)
+            continue
+        
         if not isinstance(project_name, str) or not project_name.strip():
             print(f"❌ Error: Project name must be a non-empty string: {repr(project_name)}")
             return False, {}
@@ -138,25 +753,208 @@ def validate_config_file(config_path):
                 print(f"❌ Error: Tag must be a non-empty string in project '{project_name}': {repr(tag)}")
                 return False, {}
     
-    print(f"✅ Config validation passed: {len(config)} projects defined")
+    if rule_count:
+        print(f"✅ Config validation passed: {len(config) - 1} projects, {rule_count} rules defined")
+    else:
+        print(f"✅ Config validation passed: {len(config)} projects defined")
     return True, config
 
-def validate_api_access(workspace_id, auth_header):
-    """APIトークンとワークスペースアクセスの検証"""
+# config.json で条件付きルールを記述するキー
+RULES_CONFIG_KEY = "rules"
+
+# ルールで使える条件のキー
+RULE_CONDITION_KEYS = {'project', 'project_regex', 'description_regex', 'client', 'billable', 'hours'}
+
+def is_rules_section(key, value):
+    """config.json の項目が条件付きルールの配列かどうか
+
+    "rules" という名前のプロジェクトに通常のタグ配列を設定している場合と区別するため、
+    値がオブジェクトの配列のときだけルールとして扱う。
+    """
+    return key == RULES_CONFIG_KEY and isinstance(value, list) and all(isinstance(rule, dict) for rule in value)
+
+def validate_rule(rule):
+    """条件付きルール1件を検証し、問題があればエラーメッセージを返す"""
+    unknown_keys = set(rule) - RULE_CONDITION_KEYS - {'tags', 'mode'}
+    if unknown_keys:
+        return f"unknown keys {sorted(unknown_keys)}"
+    if not RULE_CONDITION_KEYS & set(rule):
+        return f"at least one condition is required ({', '.join(sorted(RULE_CONDITION_KEYS))})"
+
+    tags = rule.get('tags')
+    if not isinstance(tags, list) or not tags or not all(isinstance(tag, str) and tag.strip() for tag in tags):
+        return "'tags' must be a non-empty list of non-empty strings"
+
+    if rule.get('mode', 'add') not in ('add', 'replace'):
+        return "'mode' must be 'add' or 'replace'"
+
+    for key in ('project', 'client'):
+        if key in rule and (not isinstance(rule[key], str) or not rule[key].strip()):
+            return f"'{key}' must be a non-empty string"
+
+    for key in ('project_regex', 'description_regex'):
+        if key in rule:
+            if not isinstance(rule[key], str):
+                return f"'{key}' must be a string"
+            try:
+                re.compile(rule[key])
+            except re.error as e:
+                return f"invalid regular expression in '{key}': {e}"
+
+    if 'billable' in rule and not isinstance(rule['billable'], bool):
+        return "'billable' must be true or false"
+
+    if 'hours' in rule:
+        hours = rule['hours']
+        if (not isinstance(hours, list) or len(hours) != 2
+                or not all(isinstance(hour, int) and not isinstance(hour, bool) and 0 <= hour <= 24
+                           for hour in hours)):
+            return "'hours' must be [start, end] with hours between 0 and 24"
+
+    return None
+
+# プロジェクトのないエントリーを表示・ログに出すときの名前
+NO_PROJECT_LABEL = "(no project)"
+
+class TagRuleEngine:
+    """config.json のマッピングとルールを起動時に一度だけコンパイルしたタグ判定器
+
+    プロジェクト名の完全一致はハッシュで引き、正規表現は1つの選択パターンにまとめて
+    一致しうるかを先に判定する。プロジェクト名ごとの候補ルールはメモ化するので、
+    ルール数が増えてもエントリーあたりの判定コストはほぼ一定になる。
+    """
+
+    def __init__(self, config, user_tz):
+        self.user_tz = user_tz
+        self.rules = []
+        self.exact_index = {}        # プロジェクト名 → ルール番号のリスト
+        self.project_regex_rules = []
+        self.unscoped_rules = []     # プロジェクト条件のないルール
+        self.uses_client = False     # client 条件を持つルールがあるか
+        self._candidates_cache = {}
+
+        # 従来形式（プロジェクト名 → タグ）は完全一致ルールとして、JSON上の位置によらず rules より前に置く
+        for key, value in config.items():
+            if not is_rules_section(key, value):
+                self._add_rule({"project": key, "tags": value})
+        for key, value in config.items():
+            if is_rules_section(key, value):
+                for rule in value:
+                    self._add_rule(rule)
+
+        # すべてのプロジェクト名の正規表現を1つにまとめ、どれにも一致しない名前を一度で除外する
+        self.project_regex_any = self._combine(rule['project_regex'] for _, rule in self.project_regex_rules)
+
+    @staticmethod
+    def _combine(patterns):
+        patterns = list(patterns)
+        if not patterns:
+            return None
+        try:
+            return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+        except re.error:
+            # インラインフラグ (?i) や名前付きグループの重複があるとまとめられないので、
+            # そのときは1件ずつ照合する
+            return None
+
+    def _add_rule(self, rule):
+        index = len(self.rules)
+        compiled = dict(rule)
+        if 'client' in rule:
+            self.uses_client = True
+        compiled['mode'] = rule.get('mode', 'add')
+        if 'description_regex' in rule:
+            compiled['description_pattern'] = re.compile(rule['description_regex'])
+        self.rules.append(compiled)
+
+        if 'project' in rule:
+            self.exact_index.setdefault(rule['project'], []).append(index)
+        elif 'project_regex' in rule:
+            compiled['project_pattern'] = re.compile(rule['project_regex'])
+            self.project_regex_rules.append((index, compiled))
+        else:
+            self.unscoped_rules.append(index)
+
+    def _candidates(self, project_name):
+        """プロジェクト条件を満たすルール番号を定義順で返す（プロジェクト名ごとにメモ化）"""
+        candidates = self._candidates_cache.get(project_name)
+        if candidates is not None:
+            return candidates
+
+        indices = list(self.exact_index.get(project_name, []))
+        indices.extend(self.unscoped_rules)
+        if self.project_regex_rules and (self.project_regex_any is None
+                                         or self.project_regex_any.search(project_name)):
+            indices.extend(index for index, rule in self.project_regex_rules
+                           if rule['project_pattern'].search(project_name))
+        candidates = sorted(indices)
+        self._candidates_cache[project_name] = candidates
+        return candidates
+
+    def _matches_conditions(self, rule, entry):
+        if 'description_pattern' in rule and not rule['description_pattern'].search(entry.get('description') or ''):
+            return False
+        if 'client' in rule and entry.get('client_name') != rule['client']:
+            return False
+        if 'billable' in rule and bool(entry.get('billable')) != rule['billable']:
+            return False
+        if 'hours' in rule:
+            start = entry.get('start')
+            if not start:
+                return False
+            hour = parse_entry_start(start).astimezone(self.user_tz).hour
+            start_hour, end_hour = rule['hours']
+            if start_hour <= end_hour:
+                if not start_hour <= hour < end_hour:
+                    return False
+            # 22時〜6時のように日付をまたぐ範囲
+            elif not (hour >= start_hour or hour < end_hour):
+                return False
+        return True
+
+    def match(self, entry, project_name):
+        """エントリーに付けるタグを返す。一致するルールがなければ None
+
+        一致したルールを定義順に適用し、mode が add ならタグを追加、
+        replace ならそれまでに決まったタグを置き換える。
+        プロジェクトのないエントリー（project_name が None）にはプロジェクト条件のないルールだけを使う。
+        """
+        tags = None
+        candidates = self._candidates(project_name) if project_name is not None else self.unscoped_rules
+        for index in candidates:
+            rule = self.rules[index]
+            if not self._matches_conditions(rule, entry):
+                continue
+            if tags is None or rule['mode'] == 'replace':
+                tags = list(rule['tags'])
+            else:
+                tags.extend(tag for tag in rule['tags'] if tag not in tags)
+        return tags
+
+    def all_tags(self):
+        """ルールで使われている全てのタグ"""
+        return {tag for rule in self.rules for tag in rule['tags']}
+
+def validate_api_access(workspace_id, auth_header, metadata_cache=None, token_key=None):
+    """APIトークンとワークスペースアクセスの検証
+
+    metadata_cache を渡すと、有効期間内の検証結果を再利用する。
+    """
     print("🔐 Validating API access...")
     
     # APIトークンの有効性確認
     try:
-        me_response = make_request_with_retry('GET', 'https://api.track.toggl.com/api/v9/me', auth_header)
-        if me_response.status_code == 401:
-            print("❌ Error: Invalid API token")
-            print("   💡 Hint: Check TOGGL_API_TOKEN in .env file")
-            return False
-        elif me_response.status_code != 200:
-            print(f"❌ Error: Failed to validate API token: {me_response.status_code} {me_response.reason}")
+        me_response, user_data = cached_get_json(
+            metadata_cache, 'me', token_key, f"{API_BASE_URL}/me", auth_header
+        )
+        if user_data is None:
+            if me_response.status_code == 401:
+                print("❌ Error: Invalid API token")
+                print("   💡 Hint: Check TOGGL_API_TOKEN in .env file")
+            else:
+                print(f"❌ Error: Failed to validate API token: {me_response.status_code} {me_response.reason}")
             return False
         
-        user_data = me_response.json()
         print(f"✅ API token valid for user: {user_data.get('fullname', 'Unknown')} ({user_data.get('email', 'Unknown')})")
         
         # デフォルトワークスペースIDの確認
@@ -170,22 +968,22 @@ def validate_api_access(workspace_id, auth_header):
     
     # ワークスペースアクセス権限の確認
     try:
-        workspace_url = f"https://api.track.toggl.com/api/v9/workspaces/{workspace_id}"
-        workspace_response = make_request_with_retry('GET', workspace_url, auth_header)
+        workspace_url = f"{API_BASE_URL}/workspaces/{workspace_id}"
+        workspace_response, workspace_data = cached_get_json(
+            metadata_cache, 'workspace', f"{token_key}:{workspace_id}", workspace_url, auth_header
+        )
         
-        if workspace_response.status_code == 403:
-            print(f"❌ Error: No access to workspace {workspace_id}")
-            print("   💡 Hint: Check if you're a member of this workspace")
-            return False
-        elif workspace_response.status_code == 404:
-            print(f"❌ Error: Workspace {workspace_id} not found")
-            print("   💡 Hint: Verify WORKSPACE_ID in .env file")
-            return False
-        elif workspace_response.status_code != 200:
-            print(f"❌ Error: Failed to access workspace: {workspace_response.status_code} {workspace_response.reason}")
+        if workspace_data is None:
+            if workspace_response.status_code == 403:
+                print(f"❌ Error: No access to workspace {workspace_id}")
+                print("   💡 Hint: Check if you're a member of this workspace")
+            elif workspace_response.status_code == 404:
+                print(f"❌ Error: Workspace {workspace_id} not found")
+                print("   💡 Hint: Verify WORKSPACE_ID in .env file")
+            else:
+                print(f"❌ Error: Failed to access workspace: {workspace_response.status_code} {workspace_response.reason}")
             return False
         
-        workspace_data = workspace_response.json()
         print(f"✅ Workspace access confirmed: {workspace_data.get('name', 'Unknown')} (ID: {workspace_id})")
         
     except requests.exceptions.RequestException as e:
@@ -194,8 +992,51 @@ def validate_api_access(workspace_id, auth_header):
     
     return True
 
-def interactive_tag_selection(entry, project_name, suggested_tags, all_used_tags):
-    """インタラクティブなタグ選択"""
+def fetch_current_user_id(auth_header, metadata_cache=None, token_key=None):
+    """APIトークンのユーザーID（/me の id）を返す。取得できなければ None"""
+    for _ in range(2):
+        _, user_data = cached_get_json(metadata_cache, 'me', token_key, f"{API_BASE_URL}/me", auth_header)
+        if user_data is None:
+            return None
+        if user_data.get('id') is not None:
+            return user_data['id']
+        if metadata_cache is None:
+            return None
+        # 以前のバージョンが保存した id のないレコードは取り直す
+        metadata_cache.invalidate('me', token_key)
+    return None
+
+# インタラクティブモードのタグ候補に使う使用履歴の日数と表示件数
+TAG_HISTORY_DAYS = 90
+TAG_SUGGESTION_LIMIT = 10
+
+class TagHistory:
+    """タグの使用回数（全体とプロジェクト別）を数え、よく使われる順に候補を返す"""
+
+    def __init__(self):
+        self.overall = Counter()
+        self.by_project = defaultdict(Counter)
+
+    def add(self, project_id, tags, count=1):
+        for tag in tags:
+            self.overall[tag] += count
+            if project_id:
+                self.by_project[project_id][tag] += count
+
+    def load_mirror(self, mirror, workspace_id, first_date):
+        """ローカルミラーから指定日以降の使用履歴を読み込む"""
+        for project_id, tag, count in mirror.tag_usage(workspace_id, first_date):
+            self.add(project_id, [tag], count)
+
+    def suggestions(self, project_id, limit=TAG_SUGGESTION_LIMIT, fallback=()):
+        """そのプロジェクトでよく使うタグ、全体でよく使うタグ、設定ファイルのタグの順に返す"""
+        ordered = [tag for tag, _ in self.by_project.get(project_id, Counter()).most_common()]
+        ordered += [tag for tag, _ in self.overall.most_common()]
+        ordered += sorted(fallback)
+        return list(dict.fromkeys(ordered))[:limit]
+
+def interactive_tag_selection(entry, project_name, suggested_tags, frequent_tags):
+    """インタラクティブなタグ選択（frequent_tags はよく使われる順のタグ候補）"""
     print(f"\n📝 Entry: {entry.get('description', 'No description')}")
     print(f"🏷️  Project: {project_name}")
     print(f"⏱️  Duration: {entry.get('duration', 0) / 3600:.1f} hours")
@@ -228,16 +1069,15 @@ def interactive_tag_selection(entry, project_name, suggested_tags, all_used_tags
                     continue
             
             elif choice == '3':
-                if all_used_tags:
+                if frequent_tags:
                     print(f"\nよく使われるタグ:")
-                    sorted_tags = sorted(list(all_used_tags))
-                    for i, tag in enumerate(sorted_tags[:10], 1):  # 最大10個表示
+                    for i, tag in enumerate(frequent_tags, 1):
                         print(f"  {i}. {tag}")
                     
                     tag_choice = input("\n番号を選択してください（複数選択は「1,3,5」のように）: ").strip()
                     try:
                         indices = [int(x.strip()) - 1 for x in tag_choice.split(',')]
-                        selected_tags = [sorted_tags[i] for i in indices if 0 <= i < len(sorted_tags)]
+                        selected_tags = [frequent_tags[i] for i in indices if 0 <= i < len(frequent_tags)]
                         if selected_tags:
                             return selected_tags
                         else:
@@ -264,262 +1104,2621 @@ def interactive_tag_selection(entry, project_name, suggested_tags, all_used_tags
             print("\n\n❌ 入力が終了しました")
             return None
 
-def collect_all_used_tags(project_tag_map):
+def collect_all_used_tags(tag_rules):
     """設定ファイルから全ての使用されているタグを収集"""
-    all_tags = set()
-    for tags in project_tag_map.values():
-        all_tags.update(tags)
-    return all_tags
+    return tag_rules.all_tags()
 
-def main():
-    """メイン処理"""
-    args = parse_arguments()
-    
-    load_dotenv()
-    
-    API_TOKEN = os.getenv('TOGGL_API_TOKEN')
-    WORKSPACE_ID = os.getenv('WORKSPACE_ID')
-    TIMEZONE = os.getenv('TIMEZONE', 'Asia/Tokyo')  # デフォルトは日本時間
-    
-    if not API_TOKEN or not WORKSPACE_ID:
-        print("❌ Error: TOGGL_API_TOKEN and WORKSPACE_ID must be set in .env file")
-        exit(1)
-    
-    # タイムゾーンの検証
-    try:
-        user_tz = ZoneInfo(TIMEZONE)
-    except Exception as e:
-        print(f"❌ Error: Invalid timezone '{TIMEZONE}'. Please check TIMEZONE in .env file.")
-        print(f"   Common timezones: Asia/Tokyo, America/New_York, Europe/London, UTC")
-        exit(1)
-    
-    # config.jsonの検証
-    config_valid, PROJECT_TAG_MAP = validate_config_file('config.json')
-    if not config_valid:
-        exit(1)
+# プロジェクト一覧取得時の1ページあたりの件数
+PROJECTS_PER_PAGE = 200
 
-    auth_header = {
-        "Authorization": f"Basic {b64encode(f'{API_TOKEN}:api_token'.encode()).decode()}"
-    }
+def fetch_project_catalog(workspace_id, auth_header, metadata_cache=None):
+    """ワークスペースの全プロジェクトをページ単位で取得し、ID→プロジェクト名の辞書を返す"""
+    if metadata_cache is not None:
+        cached_catalog = metadata_cache.get('projects', workspace_id)
+        if cached_catalog is not None:
+            print(f"📂 Loaded {len(cached_catalog)} projects from cache")
+            # JSONのキーは文字列になるので数値IDに戻す
+            return {int(project_id): name for project_id, name in cached_catalog.items()}
 
-    # APIアクセスの検証
-    if not validate_api_access(WORKSPACE_ID, auth_header):
-        exit(1)
+    catalog = {}
+    complete = False
+    url = f"{API_BASE_URL}/workspaces/{workspace_id}/projects"
+    page = 1
 
-    now_local = datetime.now(user_tz)
-    
-    # プロジェクト情報のキャッシュ
-    project_cache = {}
-    
-    # インタラクティブモード用の全タグリスト
-    all_used_tags = collect_all_used_tags(PROJECT_TAG_MAP) if args.interactive else set()
-    
-    # 処理する日付を決定
-    if args.date:
-        # 指定された日付を使用
+    while True:
+        params = {"active": "both", "page": page, "per_page": PROJECTS_PER_PAGE}
         try:
-            target_date = datetime.strptime(args.date, "%Y-%m-%d").date()
-        except ValueError:
-            print(f"❌ Error: 日付は YYYY-MM-DD 形式で指定してください (例: 2025-07-01)")
-            exit(1)
-        dates_to_process = [target_date]
-    elif args.today:
-        # 今日を処理
-        dates_to_process = [now_local.date()]
-    elif args.days:
-        # 過去N日分を処理
-        if args.days < 1:
-            print(f"❌ Error: --days は1以上の数値を指定してください")
-            exit(1)
-        dates_to_process = [now_local.date() - timedelta(days=i) for i in range(args.days)]
-    else:
-        # デフォルト: 昨日を処理
-        dates_to_process = [now_local.date() - timedelta(days=1)]
-    
-    # 各日付を処理
-    for target_date in dates_to_process:
-        print(f"\n{'='*50}")
-        print(f"🔍 Processing date: {target_date} ({TIMEZONE})")
-        print(f"{'='*50}")
-        
-        # ユーザータイムゾーンの00:00:00と23:59:59をUTCに変換
-        start_local = datetime.combine(target_date, datetime.min.time()).replace(tzinfo=user_tz)
-        end_local = datetime.combine(target_date, datetime.max.time()).replace(tzinfo=user_tz)
+            response = make_request_with_retry('GET', url, auth_header, params=params)
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️  Warning: Network error loading project list: {e}")
+            print("   ℹ️  Projects will be fetched individually")
+            break
+
+        if response.status_code != 200:
+            print(f"⚠️  Warning: Failed to load project list: {response.status_code} {response.reason}")
+            print("   ℹ️  Projects will be fetched individually")
+            break
+
+        projects = response.json() or []
+        for project in projects:
+            catalog[project['id']] = project.get('name', '')
+
+        if len(projects) < PROJECTS_PER_PAGE:
+            complete = True
+            break
+        page += 1
+
+    # 途中で失敗した不完全な一覧はキャッシュしない
+    if complete and metadata_cache is not None:
+        metadata_cache.put('projects', workspace_id, catalog)
+
+    if catalog:
+        print(f"📂 Loaded {len(catalog)} projects from workspace")
+    return catalog
+
+def resolve_project_name(workspace_id, auth_header, project_cache, project_id, metadata_cache=None, cache_stats=None):
+    """プロジェクトIDからプロジェクト名を解決する
+
+    一覧に含まれないプロジェクト（アーカイブ済み・他ワークスペースなど）のみ個別に取得する。
+    取得に失敗したIDは None としてキャッシュし、同じ実行中に再取得しない。
+    cache_stats（{"hits", "misses"} の辞書）を渡すと、キャッシュのヒット・ミスを数える。
+    """
+    hit = project_id in project_cache
+    get_metrics().increment('project_cache_hits' if hit else 'project_cache_misses')
+    if cache_stats is not None:
+        cache_stats['hits' if hit else 'misses'] += 1
+    if hit:
+        return project_cache[project_id]
+
+    project_url = f"{API_BASE_URL}/workspaces/{workspace_id}/projects/{project_id}"
+    try:
+        project_response, project_data = cached_get_json(
+            metadata_cache, 'project', f"{workspace_id}:{project_id}", project_url, auth_header
+        )
+    except requests.exceptions.RequestException as e:
+        # ネットワークエラーは一時的な可能性があるのでキャッシュしない
+        print(f"❌ Network error fetching project {project_id}: {e}")
+        return None
+
+    if project_data is None:
+        print(f"❌ Failed to fetch project {project_id}: {project_response.status_code} {project_response.reason}")
+        if project_response.status_code == 403:
+            print(f"   ℹ️  Hint: Check if you have access to this project in workspace {workspace_id}")
+        elif project_response.status_code == 404:
+            print(f"   ℹ️  Hint: Project {project_id} may have been deleted or moved")
+        project_cache[project_id] = None
+        return None
+
+    project_name = project_data.get('name', '')
+    # キャッシュに保存
+    project_cache[project_id] = project_name
+    return project_name
+
+class TagIndex:
+    """ワークスペースのタグ名を大文字・小文字を区別せずに引く索引
+
+    Toggl ではタグ名の大文字・小文字違いは同じタグとして扱われるので、
+    設定ファイルや入力のタグはワークスペースでの表記にそろえてから送る。
+    """
+
+    def __init__(self, names=()):
+        self.by_key = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.by_key)
+
+    def __contains__(self, tag):
+        return tag.casefold() in self.by_key
+
+    def add(self, name):
+        self.by_key.setdefault(name.casefold(), name)
+
+    def canonical(self, tags):
+        """タグをワークスペースでの表記にそろえる（重複は除く）"""
+        return list(dict.fromkeys(self.by_key.get(tag.casefold(), tag) for tag in tags))
+
+    def missing(self, tags):
+        """ワークスペースにないタグを返す（大文字・小文字違いの重複は1つにまとめる）"""
+        missing = {}
+        for tag in tags:
+            if tag not in self:
+                missing.setdefault(tag.casefold(), tag)
+        return list(missing.values())
+
+def load_workspace_tags(workspace_id, auth_header, metadata_cache=None, refresh=False):
+    """ワークスペースのタグ一覧を TagIndex として返す。取得できなければ None
+
+    refresh が True ならキャッシュを使わずに取得し直す。
+    """
+    if refresh and metadata_cache is not None:
+        metadata_cache.invalidate('tags', workspace_id)
+    url = f"{API_BASE_URL}/workspaces/{workspace_id}/tags"
+    try:
+        response, tags = cached_get_json(metadata_cache, 'tags', workspace_id, url, auth_header)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️  Warning: Could not load workspace tags: Network error: {e}")
+        return None
+    if tags is None:
+        print(f"⚠️  Warning: Could not load workspace tags: {response.status_code} {response.reason}")
+        return None
+    return TagIndex(tag['name'] for tag in tags or [])
+
+def create_workspace_tags(workspace_id, auth_header, tag_index, names, concurrency=1):
+    """ワークスペースにないタグをまとめて作成し、作成できなかったタグのリストを返す"""
+    url = f"{API_BASE_URL}/workspaces/{workspace_id}/tags"
 
-        # ISO形式でUTC時刻として出力
-        start_date = start_local.astimezone(ZoneInfo("UTC")).isoformat().replace("+00:00", "Z")
-        end_date = end_local.astimezone(ZoneInfo("UTC")).isoformat().replace("+00:00", "Z")
+    def create(name):
+        try:
+            response = make_request_with_retry('POST', url, auth_header,
+                                               json={"name": name, "workspace_id": int(workspace_id)})
+        except requests.exceptions.RequestException as e:
+            return f"Network error: {e}"
+        # 他のユーザーが先に作成していた場合も成功として扱う
+        if response.status_code == 200 or (response.status_code == 400 and 'exist' in response.text.lower()):
+            return None
+        return f"{response.status_code} {response.reason}"
+
+    failed = []
+    for name, error in zip(names, run_concurrently(create, names, concurrency)):
+        if error:
+            print(f"❌ Failed to create tag '{name}': {error}")
+            failed.append(name)
+        else:
+            print(f"🆕 Created tag '{name}'")
+            tag_index.add(name)
+    return failed
+
+def prepare_workspace_tags(args, workspace_id, auth_header, tags, metadata_cache=None, concurrency=1):
+    """使うタグをワークスペースのタグ一覧と照合し、ないタグを実行前にまとめて作成する
+
+    戻り値は (続行してよいか, TagIndex)。--no-create-tags でないタグがあれば続行しない。
+    タグ一覧が取得できない場合は照合せずに (True, None) を返す。
+    """
+    tag_index = load_workspace_tags(workspace_id, auth_header, metadata_cache)
+    if tag_index is None:
+        return True, None
+    missing = tag_index.missing(tags)
+    if missing and metadata_cache is not None:
+        # キャッシュした後にワークスペースでタグが作られているかもしれないので取り直す
+        tag_index = load_workspace_tags(workspace_id, auth_header, metadata_cache, refresh=True)
+        if tag_index is None:
+            return True, None
+        missing = tag_index.missing(tags)
+
+    for tag in sorted(set(tags) - set(missing)):
+        if tag_index.canonical([tag])[0] != tag:
+            print(f"ℹ️  Tag '{tag}' matches workspace tag '{tag_index.canonical([tag])[0]}', using that spelling")
+
+    if not missing:
+        return True, tag_index
+    print(f"⚠️  {len(missing)} tags do not exist in workspace {workspace_id}: {', '.join(missing)}")
+    if args.no_create_tags:
+        print("❌ Error: Fix the tag names in the config or run without --no-create-tags to create them")
+        return False, tag_index
+    if args.dry_run:
+        print("🔍 [DRY RUN] They would be created before tagging")
+        return True, tag_index
+
+    # 作成できなかったタグも、タグ付けの際にAPI側で作られうるので処理は続ける
+    create_workspace_tags(workspace_id, auth_header, tag_index, missing, concurrency)
+    if metadata_cache is not None:
+        # 作成したタグを含む一覧を次回取り直す
+        metadata_cache.invalidate('tags', workspace_id)
+    return True, tag_index
+
+# 1回のリクエストで取得する期間の最大日数
+MAX_FETCH_WINDOW_DAYS = 31
+
+def split_fetch_windows(dates):
+    """日付を順番どおりに、初日から最終日までが MAX_FETCH_WINDOW_DAYS 日に収まるまとまりに分ける
+
+    飛び飛びの日付（--resume の未完了日や --undo のスナップショット日）でも、
+    1回のリクエストの期間が上限を超えないよう暦の日数で区切る。
+    """
+    windows = []
+    for target_date in dates:
+        if windows:
+            window = windows[-1]
+            span = max(max(window), target_date) - min(min(window), target_date)
+            if span < timedelta(days=MAX_FETCH_WINDOW_DAYS):
+                window.append(target_date)
+                continue
+        windows.append([target_date])
+    return windows
+
+def to_utc_iso(local_datetime):
+    """タイムゾーン付き日時をAPI用のUTC ISO形式文字列に変換"""
+    return local_datetime.astimezone(ZoneInfo("UTC")).isoformat().replace("+00:00", "Z")
+
+def parse_entry_start(start):
+    """エントリーのstart文字列をタイムゾーン付きdatetimeに変換"""
+    return datetime.fromisoformat(start.replace("Z", "+00:00"))
 
-        url = "https://api.track.toggl.com/api/v9/me/time_entries"
+# エントリー一覧のレスポンスを読み込む単位（バイト）
+STREAM_CHUNK_BYTES = 64 * 1024
+
+class TimeEntry:
+    """タグ付けに使うフィールドだけを持つタイムエントリー
+
+    APIのレスポンスには使わないフィールドも多いので、辞書のまま持たずに必要な値だけを
+    __slots__ に移してメモリを抑える。既存の処理と同じく get() や entry['id'] でも読める。
+    """
+
+    __slots__ = ('id', 'project_id', 'tags', 'description', 'start', 'duration',
+                 'billable', 'client_name', 'project_name')
+
+    def __init__(self, id, project_id=None, tags=None, description=None, start=None, duration=0,
+                 billable=False, client_name=None, project_name=None):
+        self.id = id
+        self.project_id = project_id
+        self.tags = tags or []
+        self.description = description
+        self.start = start
+        self.duration = duration
+        self.billable = billable
+        self.client_name = client_name
+        self.project_name = project_name
+
+    @classmethod
+    def from_api(cls, data):
+        """APIのエントリー（辞書）から作る"""
+        return cls(data['id'], data.get('project_id'), data.get('tags'), data.get('description'),
+                   data.get('start'), data.get('duration') or 0, data.get('billable', False),
+                   data.get('client_name'), data.get('project_name'))
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+def iter_json_array(response, chunk_size=STREAM_CHUNK_BYTES):
+    """JSON配列のレスポンスを少しずつ読み込み、要素を1つずつ返す
+
+    response は stream=True で取得したもの。本文全体を文字列やリストとして持たないので、
+    件数が多くてもメモリに載るのは読み込み中のチャンクと要素1つ分だけになる。
+    本文が閉じ括弧の前で切れている場合や、配列と null 以外の値の場合は JSONDecodeError を送出する。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    buffer = ''
+    started = False
+    chunks = response.iter_content(chunk_size=chunk_size)
+    while True:
+        chunk = next(chunks, None)
+        buffer += text_decoder.decode(chunk or b'', final=chunk is None)
+        position = 0
+        while True:
+            # 要素の間の空白とカンマを読み飛ばす
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    # 配列でなければ null だけを受け付ける（残りをまとめて読んで確かめる）
+                    if buffer[position] != 'n':
+                        raise json.JSONDecodeError("Expecting array or null", buffer, position)
+                    if chunk is not None:
+                        break
+                    if json.loads(buffer[position:]) is not None:
+                        raise json.JSONDecodeError("Expecting array or null", buffer, position)
+                    return
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if chunk is None:
+                    raise
+                break  # 要素の途中でチャンクが切れているので続きを読む
+            yield item
+        buffer = buffer[position:]
+        if chunk is None:
+            # 閉じ括弧の前で本文が終わっている
+            raise json.JSONDecodeError("Expecting ']'" if started else "Expecting value", buffer, len(buffer))
+
+def iter_time_entry_windows(auth_header, user_tz, dates):
+    """複数日分のタイムエントリーを取得APIの期間上限ごとに取得し、ローカル日付ごとに振り分けて返す
+
+    期間ごとに (日付→エントリーリストの辞書, 取得に失敗した日付→エラー内容の辞書) を返すジェネレーター。
+    期間は dates の順に区切るので、呼び出し側は日付の順番どおりに処理できる。
+    """
+    metrics = get_metrics()
+    for window in split_fetch_windows(dates):
+        window = sorted(window)
+        entries_by_date = {target_date: [] for target_date in window}
+        failed_dates = {}
+
+        # ユーザータイムゾーンの初日00:00:00と最終日23:59:59をUTCに変換
+        start_local = datetime.combine(window[0], datetime.min.time()).replace(tzinfo=user_tz)
+        end_local = datetime.combine(window[-1], datetime.max.time()).replace(tzinfo=user_tz)
+
+        url = f"{API_BASE_URL}/me/time_entries"
         params = {
-            "start_date": start_date,
-            "end_date": end_date
+            "start_date": to_utc_iso(start_local),
+            "end_date": to_utc_iso(end_local),
+            "meta": "true"  # クライアント名などルール判定に使う付加情報を含める
         }
 
-        response = make_request_with_retry('GET', url, auth_header, params=params)
+        with metrics.span('fetch_entries'):
+            try:
+                response = make_request_with_retry('GET', url, auth_header, params=params, stream=True)
+                if response.status_code != 200:
+                    for target_date in window:
+                        failed_dates[target_date] = f"{response.status_code} {response.reason}\nResponse: {response.text}"
+                else:
+                    with response:
+                        for data in iter_json_array(response):
+                            start = data.get('start')
+                            if not start:
+                                continue
+                            local_date = parse_entry_start(start).astimezone(user_tz).date()
+                            # 連続しない日付の間に挟まった日など、対象外の日付は捨てる
+                            if local_date in entries_by_date:
+                                entries_by_date[local_date].append(TimeEntry.from_api(data))
+            except requests.exceptions.RequestException as e:
+                for target_date in window:
+                    failed_dates[target_date] = f"Network error: {e}"
+                    entries_by_date[target_date] = []
+            except json.JSONDecodeError as e:
+                # 本文が途中で切れていた場合も、その期間の日付をまとめて失敗扱いにする
+                for target_date in window:
+                    failed_dates[target_date] = f"Invalid response: {e}"
+                    entries_by_date[target_date] = []
+
+        yield entries_by_date, failed_dates
 
-        if response.status_code != 200:
-            print(f"❌ Failed to fetch time entries: {response.status_code} {response.reason}")
-            print(f"Response: {response.text}")
-            continue
+def fetch_time_entries_by_date(auth_header, user_tz, dates):
+    """複数日分のタイムエントリーをまとめて取得し、ローカル日付ごとに振り分ける
 
-        entries = response.json()
-        print(f"📊 Found {len(entries)} time entries")
+    戻り値は (日付→エントリーリストの辞書, 取得に失敗した日付→エラー内容の辞書)。
+    """
+    entries_by_date = {}
+    failed_dates = {}
+    for window_entries, window_failed in iter_time_entry_windows(auth_header, user_tz, sorted(dates)):
+        entries_by_date.update(window_entries)
+        failed_dates.update(window_failed)
+    return entries_by_date, failed_dates
 
-        processed = 0
-        success = 0
-        failed = 0
+# 変更ログの保存先
+LOG_DIR = "logs"
 
-        log_entries = []
+# 変更ログのファイル名（書き込み中のセグメント）
+LOG_FILE_NAME = "toggl_tag_log.jsonl"
 
-        for entry in entries:
-            if entry.get('tags') and len(entry['tags']) > 0:
+# このサイズを超えたらログをローテーションする（バイト）
+LOG_ROTATE_BYTES = 10 * 1024 * 1024
+
+# 圧縮済みログを保持する日数
+LOG_RETENTION_DAYS = 30
+
+class RunLogWriter:
+    """変更ログを追記専用のJSON Linesファイルに1レコードずつ書き出す
+
+    サイズ超過または日付が変わったときにローテーションし、
+    古いセグメントは gzip で圧縮して保持期間を過ぎたら削除する。
+    """
+
+    def __init__(self, log_dir=LOG_DIR, rotate_bytes=LOG_ROTATE_BYTES, retention_days=LOG_RETENTION_DAYS):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, LOG_FILE_NAME)
+        self.rotate_bytes = rotate_bytes
+        self.retention_days = retention_days
+        self.file = None
+        self.opened_date = None
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _needs_rotation(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size == 0:
+            return False
+        if stat.st_size >= self.rotate_bytes:
+            return True
+        return datetime.fromtimestamp(stat.st_mtime).date() != datetime.now().date()
+
+    def _rotate(self):
+        """書き込み中のセグメントを圧縮して退避し、保持期間を過ぎたセグメントを削除する"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        stamp = datetime.fromtimestamp(os.path.getmtime(self.path)).strftime("%Y%m%d_%H%M%S")
+        base_name = LOG_FILE_NAME.replace('.jsonl', f'_{stamp}')
+        archive_path = os.path.join(self.log_dir, f"{base_name}.jsonl.gz")
+        suffix = 1
+        while os.path.exists(archive_path):
+            archive_path = os.path.join(self.log_dir, f"{base_name}_{suffix}.jsonl.gz")
+            suffix += 1
+
+        with open(self.path, 'rb') as src, gzip.open(archive_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_days * 24 * 60 * 60
+        for archive_path in list_log_segments(self.log_dir):
+            if archive_path.endswith('.gz') and os.path.getmtime(archive_path) < cutoff:
+                os.remove(archive_path)
+
+    def write(self, record):
+        """レコードを1行追記してすぐにフラッシュする"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self.file is not None and (self.file.tell() >= self.rotate_bytes
+                                          or self.opened_date != datetime.now().date()):
+                self._rotate()
+            if self.file is None:
+                if self._needs_rotation():
+                    self._rotate()
+                self.file = open(self.path, 'a', encoding='utf-8')
+                self.opened_date = datetime.now().date()
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def list_log_segments(log_dir=LOG_DIR):
+    """ログセグメントを古い順に返す（圧縮済みセグメント → 書き込み中のセグメント）"""
+    prefix = LOG_FILE_NAME.replace('.jsonl', '_')
+    try:
+        names = os.listdir(log_dir)
+    except FileNotFoundError:
+        return []
+    archives = sorted(name for name in names if name.startswith(prefix) and name.endswith('.jsonl.gz'))
+    segments = [os.path.join(log_dir, name) for name in archives]
+    current_path = os.path.join(log_dir, LOG_FILE_NAME)
+    if os.path.exists(current_path):
+        segments.append(current_path)
+    return segments
+
+def read_log_records(log_dir=LOG_DIR):
+    """全セグメントのログレコードを古い順に1件ずつ返すジェネレーター"""
+    for segment_path in list_log_segments(log_dir):
+        opener = gzip.open if segment_path.endswith('.gz') else open
+        with opener(segment_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた最終行などは読み飛ばす
+                    continue
+
+# 差分同期の状態（前回同期時刻）の保存先
+SYNC_STATE_PATH = os.path.join("cache", "sync_state.json")
+
+# 初回の差分同期で遡る期間（秒）
+INCREMENTAL_INITIAL_LOOKBACK_SECONDS = 2 * 24 * 60 * 60
+
+# 時計のずれや処理中の更新を取りこぼさないよう、前回同期時刻から重ねて取得する秒数
+INCREMENTAL_SYNC_OVERLAP_SECONDS = 60
+
+# 複数ユーザーを並行処理する場合に同期状態ファイルの読み書きを直列化するロック
+_sync_state_lock = threading.Lock()
+
+def save_sync_point(sync_key, synced_at, path=SYNC_STATE_PATH):
+    """同期時刻を1件更新する（他のキーを上書きしないよう、最新の状態を読み直してから書く）"""
+    with _sync_state_lock:
+        sync_state = load_sync_state(path)
+        sync_state[sync_key] = synced_at
+        write_json_atomic(path, sync_state)
+
+def load_sync_state(path=SYNC_STATE_PATH):
+    """差分同期の状態を読み込む"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        print(f"⚠️  Warning: Ignoring corrupted sync state file {path}")
+        return {}
+
+def fetch_changed_time_entries(auth_header, user_tz, since):
+    """since（UNIX時刻）以降に作成・更新されたエントリーを取得し、ローカル日付ごとに振り分ける
+
+    戻り値は (日付→エントリーリストの辞書, 削除済みエントリーIDのリスト, レスポンス)。
+    取得に失敗した場合は辞書の代わりに None を返す。
+    """
+    url = f"{API_BASE_URL}/me/time_entries"
+    response = make_request_with_retry('GET', url, auth_header, params={"since": int(since), "meta": "true"},
+                                       stream=True)
+    if response.status_code != 200:
+        return None, [], response
+
+    entries_by_date = {}
+    deleted_ids = []
+    with response:
+        for data in iter_json_array(response):
+            # 削除されたエントリーも返ってくるので除外する
+            if data.get('server_deleted_at'):
+                deleted_ids.append(data['id'])
                 continue
-            
-            project_id = entry.get('project_id')
-            if not project_id:
+            start = data.get('start')
+            if not start:
                 continue
-            
-            # プロジェクト情報をキャッシュから取得、なければAPIで取得
-            if project_id in project_cache:
-                project_name = project_cache[project_id]
-            else:
-                project_url = f"https://api.track.toggl.com/api/v9/workspaces/{WORKSPACE_ID}/projects/{project_id}"
-                try:
-                    project_response = make_request_with_retry('GET', project_url, auth_header)
-                    
-                    if project_response.status_code != 200:
-                        print(f"❌ Failed to fetch project {project_id}: {project_response.status_code} {project_response.reason}")
-                        if project_response.status_code == 403:
-                            print(f"   ℹ️  Hint: Check if you have access to this project in workspace {WORKSPACE_ID}")
-                        elif project_response.status_code == 404:
-                            print(f"   ℹ️  Hint: Project {project_id} may have been deleted or moved")
+            local_date = parse_entry_start(start).astimezone(user_tz).date()
+            entries_by_date.setdefault(local_date, []).append(TimeEntry.from_api(data))
+
+    return entries_by_date, deleted_ids, response
+
+# 中断時に再開するためのチェックポイントジャーナルの保存先
+CHECKPOINT_DIR = os.path.join("cache", "checkpoints")
+
+class CheckpointJournal:
+    """実行中の計画・適用済みの更新を記録する追記専用ジャーナル（JSON Lines）
+
+    1行目に実行IDと対象日付を記録し、以降は更新の計画（planned）、適用済み（applied）、
+    処理を終えた日付（date_done）を追記する。各書き込みは fsync するので、
+    強制終了やネットワーク障害で止まっても --resume で続きから再開できる。
+    計画を記録済みの日付は、再開時にその計画のうち未適用の更新だけをやり直す。
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.dates = []
+        self.started_at = None
+        self.run_id = None
+        self.done_dates = set()
+        self.applied = set()
+        self.planned = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def path_for(token_key, workspace_id):
+        return os.path.join(CHECKPOINT_DIR, f"{token_key}_{safe_file_name(str(workspace_id))}.jsonl")
+
+    @classmethod
+    def load(cls, path, read_only=False):
+        """既存のジャーナルを読み込む。存在しないか先頭が壊れていれば None を返す"""
+        journal = cls(path, read_only)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で落ちた最終行は読み飛ばす
                         continue
-                    
-                    project_data = project_response.json()
-                    project_name = project_data.get('name', '')
-                    # キャッシュに保存
-                    project_cache[project_id] = project_name
-                    
-                except requests.exceptions.RequestException as e:
-                    print(f"❌ Network error fetching project {project_id}: {e}")
-                    continue
-            
-            # タグの決定
-            suggested_tags = PROJECT_TAG_MAP.get(project_name, [])
-            
-            if args.interactive:
-                # インタラクティブモード: ユーザーがタグを選択
-                selected_tags = interactive_tag_selection(entry, project_name, suggested_tags, all_used_tags)
-                if selected_tags is None:
-                    print("⏭️  Skipped")
-                    continue
-                tags_to_add = selected_tags
-            else:
-                # 通常モード: 設定ファイルのマッピングに従う
-                if project_name not in PROJECT_TAG_MAP:
-                    continue
-                tags_to_add = suggested_tags
-            
-            update_url = f"https://api.track.toggl.com/api/v9/workspaces/{WORKSPACE_ID}/time_entries/{entry['id']}"
-            update_data = {"tags": tags_to_add}
-            
-            processed += 1
-            
-            if args.dry_run:
-                # Dry-runモードでは実際に更新しない
-                print(f"🔍 [DRY RUN] {project_name} -> {tags_to_add}")
-                log_entry = {
-                    "timestamp": now_local.isoformat(),
-                    "status": "dry_run",
-                    "entry_id": entry['id'],
-                    "project_name": project_name,
-                    "description": entry.get('description', ''),
-                    "start": entry.get('start', ''),
-                    "duration": entry.get('duration', 0),
-                    "tags_to_add": tags_to_add
+                    journal._apply(record)
+        except FileNotFoundError:
+            return None
+        if journal.started_at is None:
+            return None
+        return journal
+
+    def _apply(self, record):
+        record_type = record.get('type')
+        if record_type == 'run':
+            self.dates = [datetime.strptime(d, "%Y-%m-%d").date() for d in record['dates']]
+            self.started_at = record['started_at']
+            self.run_id = record.get('run_id')
+        elif record_type == 'planned':
+            target_date = datetime.strptime(record['target_date'], "%Y-%m-%d").date()
+            self.planned.setdefault(target_date, {})[record['entry_id']] = record['tags']
+        elif record_type == 'applied':
+            self.applied.add((record['entry_id'], tuple(record['tags'])))
+        elif record_type == 'date_done':
+            self.done_dates.add(datetime.strptime(record['target_date'], "%Y-%m-%d").date())
+
+    def start(self, dates, started_at, run_id=None):
+        """新しい実行を開始する（既存のジャーナルは置き換える）"""
+        self.dates = list(dates)
+        self.started_at = started_at
+        self.run_id = run_id
+        self.done_dates = set()
+        self.applied = set()
+        self.planned = {}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+        self._append([{"type": "run", "run_id": run_id, "started_at": started_at,
+                       "dates": [str(d) for d in self.dates]}])
+
+    def pending_dates(self):
+        return [d for d in self.dates if d not in self.done_dates]
+
+    def is_applied(self, entry_id, tags):
+        return (entry_id, tuple(tags)) in self.applied
+
+    def planned_for(self, target_date):
+        """中断前の実行でその日付に計画した更新（エントリーID → タグ）。未計画なら None"""
+        return self.planned.get(target_date)
+
+    def record_planned(self, target_date, updates):
+        self._append([
+            {"type": "planned", "target_date": str(target_date), "entry_id": update['entry']['id'], "tags": update['tags']}
+            for update in updates
+        ])
+
+    def record_results(self, update_results):
+        """バルク更新のチャンク結果のうち、成功したものを適用済みとして記録する"""
+        records = [
+            {"type": "applied", "entry_id": update['entry']['id'], "tags": update['tags']}
+            for update, result in update_results
+            if result['status'] == 'success'
+        ]
+        with self._lock:
+            self.applied.update((record['entry_id'], tuple(record['tags'])) for record in records)
+        self._append(records)
+
+    def record_date_done(self, target_date):
+        self.done_dates.add(target_date)
+        self._append([{"type": "date_done", "target_date": str(target_date)}])
+
+    def finish(self):
+        """すべての日付を処理し終えたらジャーナルを削除する"""
+        if self.read_only:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _append(self, records):
+        if self.read_only or not records:
+            return
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+def new_run_id(suffix=''):
+    """実行IDを作る（同じ秒に始まった実行が混ざらないよう乱数を付ける）"""
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}{suffix}"
+
+# 変更前のタグを保存するスナップショットDBの保存先
+SNAPSHOT_DB_PATH = os.path.join("backups", "snapshots.sqlite3")
+
+class SnapshotStore:
+    """更新前のタグを実行ID×エントリーIDで保存するSQLiteストア（--undo 用）
+
+    スナップショットは (実行ID, トークン, ワークスペース, 日付, エントリーID) の順で
+    クラスタ化して保存するので、取り消し時は日付の範囲ごとに少しずつ読み出せる。
+    フリートモードで複数スレッドから使うため、接続はロックで保護する。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT NOT NULL,
+            token_key TEXT NOT NULL,
+            workspace_id TEXT NOT NULL,
+            timezone TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            undone_at TEXT,
+            PRIMARY KEY (run_id, token_key, workspace_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS snapshots (
+            run_id TEXT NOT NULL,
+            token_key TEXT NOT NULL,
+            workspace_id TEXT NOT NULL,
+            target_date TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            original_tags TEXT NOT NULL,
+            applied_tags TEXT NOT NULL,
+            PRIMARY KEY (run_id, token_key, workspace_id, target_date, entry_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=SNAPSHOT_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+
+    def record(self, run, target_date, updates):
+        """タグ更新を送信する前に、各エントリーの現在のタグと適用後のタグを保存する
+
+        run は {"run_id", "token_key", "workspace_id", "timezone", "started_at"} を持つ辞書。
+        """
+        rows = []
+        for update in updates:
+            original_tags = list(update['entry'].get('tags') or [])
+            applied_tags = original_tags + [tag for tag in update['tags'] if tag not in original_tags]
+            rows.append((
+                run['run_id'], run['token_key'], run['workspace_id'], str(target_date), update['entry']['id'],
+                json.dumps(original_tags, ensure_ascii=False), json.dumps(applied_tags, ensure_ascii=False)
+            ))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, token_key, workspace_id, timezone, started_at) VALUES (?, ?, ?, ?, ?)",
+                (run['run_id'], run['token_key'], run['workspace_id'], run['timezone'], run['started_at'])
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def find_run(self, run_id, token_key, workspace_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT timezone, started_at, undone_at, "
+                "(SELECT COUNT(*) FROM snapshots s WHERE s.run_id = r.run_id AND s.token_key = r.token_key "
+                "AND s.workspace_id = r.workspace_id) "
+                "FROM runs r WHERE run_id = ? AND token_key = ? AND workspace_id = ?",
+                (run_id, token_key, workspace_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"run_id": run_id, "timezone": row[0], "started_at": row[1], "undone_at": row[2], "entries": row[3]}
+
+    def recent_runs(self, token_key, workspace_id, limit=10):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, started_at, undone_at FROM runs WHERE token_key = ? AND workspace_id = ? "
+                "ORDER BY started_at DESC LIMIT ?",
+                (token_key, workspace_id, limit)
+            ).fetchall()
+        return [{"run_id": row[0], "started_at": row[1], "undone_at": row[2]} for row in rows]
+
+    def snapshot_dates(self, run_id, token_key, workspace_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT target_date FROM snapshots WHERE run_id = ? AND token_key = ? AND workspace_id = ? "
+                "ORDER BY target_date",
+                (run_id, token_key, workspace_id)
+            ).fetchall()
+        return [datetime.strptime(row[0], "%Y-%m-%d").date() for row in rows]
+
+    def iter_snapshots(self, run_id, token_key, workspace_id, first_date, last_date):
+        """指定した日付範囲のスナップショットを (日付, エントリーID, 変更前タグ, 適用後タグ) で順に返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT target_date, entry_id, original_tags, applied_tags FROM snapshots "
+                "WHERE run_id = ? AND token_key = ? AND workspace_id = ? AND target_date BETWEEN ? AND ?",
+                (run_id, token_key, workspace_id, str(first_date), str(last_date))
+            ).fetchall()
+        for target_date, entry_id, original_tags, applied_tags in rows:
+            yield datetime.strptime(target_date, "%Y-%m-%d").date(), entry_id, json.loads(original_tags), json.loads(applied_tags)
+
+    def mark_undone(self, run_id, token_key, workspace_id, undone_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE runs SET undone_at = ? WHERE run_id = ? AND token_key = ? AND workspace_id = ?",
+                (undone_at, run_id, token_key, workspace_id)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# 取得したタイムエントリーのローカルミラー（report サブコマンドの集計に使う）
+MIRROR_DB_PATH = os.path.join("cache", "entries.sqlite3")
+
+class EntryMirror:
+    """APIから取得したタイムエントリーを保存するSQLiteミラー
+
+    エントリーは日付順のカバリングインデックス、タグは (日付, タグ) 順に作業時間ごと
+    保存するので、集計はテーブル本体を読まずにインデックスの範囲走査だけで済む。
+    日付範囲で取得した結果はその日付分を丸ごと置き換えるので、削除されたエントリーも反映される。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            entry_id INTEGER PRIMARY KEY,
+            workspace_id TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            start TEXT NOT NULL,
+            duration INTEGER NOT NULL,
+            project_id INTEGER,
+            tagged INTEGER NOT NULL,
+            user_key TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS entries_by_date
+            ON entries (workspace_id, start_date, duration, tagged, project_id);
+        CREATE TABLE IF NOT EXISTS entry_tags (
+            workspace_id TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            PRIMARY KEY (workspace_id, start_date, tag, entry_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS entry_tags_by_entry ON entry_tags (entry_id);
+        CREATE TABLE IF NOT EXISTS projects (
+            workspace_id TEXT NOT NULL,
+            project_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (workspace_id, project_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=MIRROR_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+            if 'user_key' not in columns:
+                # ユーザー列のない古いミラーに列を追加する
+                self._conn.execute("ALTER TABLE entries ADD COLUMN user_key TEXT NOT NULL DEFAULT ''")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_by_user_date ON entries (workspace_id, user_key, start_date)"
+            )
+
+    def store(self, workspace_id, entries_by_date, project_cache, replace_dates=True, user_key=''):
+        """日付ごとのエントリーを保存する
+
+        replace_dates が True なら、そのユーザー（user_key）のその日付の既存エントリーを削除してから保存する
+        （期間指定で取得した結果に使う）。差分取得の結果には False を指定する。
+        /me/time_entries は自分のエントリーしか返さないので、同じワークスペースの
+        他のユーザーのエントリーは消さない。
+        """
+        workspace_id = str(workspace_id)
+        entry_rows = []
+        tag_rows = []
+        project_rows = {}
+        for target_date, entries in entries_by_date.items():
+            for entry in entries:
+                project_id = entry.get('project_id')
+                project_name = entry.get('project_name') or (project_cache.get(project_id) if project_id else None)
+                if project_id and project_name:
+                    project_rows[project_id] = project_name
+                tags = entry.get('tags') or []
+                duration = entry.get('duration') or 0
+                entry_rows.append((
+                    entry['id'], workspace_id, str(target_date), entry.get('start', ''),
+                    duration, project_id, 1 if tags else 0, user_key
+                ))
+                tag_rows.extend((workspace_id, str(target_date), tag, entry['id'], duration) for tag in tags)
+
+        with self._lock, self._conn:
+            if replace_dates:
+                # ユーザー列を追加する前に保存した行（user_key が空）も置き換えの対象にする
+                dates = [(workspace_id, user_key, str(target_date)) for target_date in entries_by_date]
+                self._conn.executemany(
+                    "DELETE FROM entry_tags WHERE entry_id IN (SELECT entry_id FROM entries "
+                    "WHERE workspace_id = ? AND user_key IN (?, '') AND start_date = ?)", dates
+                )
+                self._conn.executemany(
+                    "DELETE FROM entries WHERE workspace_id = ? AND user_key IN (?, '') AND start_date = ?", dates
+                )
+            # 別の日付に移動したエントリーもあるので、タグはエントリーIDでも入れ替える
+            self._conn.executemany("DELETE FROM entry_tags WHERE entry_id = ?", [(row[0],) for row in entry_rows])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries "
+                "(entry_id, workspace_id, start_date, start, duration, project_id, tagged, user_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entry_rows
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO entry_tags VALUES (?, ?, ?, ?, ?)", tag_rows)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO projects VALUES (?, ?, ?)",
+                [(workspace_id, project_id, name) for project_id, name in project_rows.items()]
+            )
+
+    def delete(self, entry_ids):
+        rows = [(entry_id,) for entry_id in entry_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entry_tags WHERE entry_id = ?", rows)
+            self._conn.executemany("DELETE FROM entries WHERE entry_id = ?", rows)
+
+    def set_tags(self, tags_by_entry):
+        """更新に成功したエントリーのタグをミラーにも反映する（{エントリーID: タグリスト}）"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entry_tags WHERE entry_id = ?", [(entry_id,) for entry_id in tags_by_entry])
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entry_tags "
+                "SELECT workspace_id, start_date, ?, entry_id, duration FROM entries WHERE entry_id = ?",
+                [(tag, entry_id) for entry_id, tags in tags_by_entry.items() for tag in tags]
+            )
+            self._conn.executemany(
+                "UPDATE entries SET tagged = ? WHERE entry_id = ?",
+                [(1 if tags else 0, entry_id) for entry_id, tags in tags_by_entry.items()]
+            )
+
+    def date_range(self, workspace_id=None):
+        query = "SELECT MIN(start_date), MAX(start_date) FROM entries"
+        params = ()
+        if workspace_id:
+            query += " WHERE workspace_id = ?"
+            params = (str(workspace_id),)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()
+
+    def tag_usage(self, workspace_id, first_date):
+        """指定日以降に使われたタグの (プロジェクトID, タグ, 使用回数) を返す"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT e.project_id, t.tag, COUNT(*) FROM entry_tags t JOIN entries e ON e.entry_id = t.entry_id "
+                "WHERE t.workspace_id = ? AND t.start_date >= ? GROUP BY e.project_id, t.tag",
+                (str(workspace_id), str(first_date))
+            ).fetchall()
+
+    def aggregate(self, first_date, last_date, period="month", top=10, workspace_id=None):
+        """期間内のエントリーを集計する（実行中のエントリーは除く）
+
+        日別の集計だけをSQLで行い、週・月単位と全体の合計はその結果から求める。
+        戻り値は合計、プロジェクト別、タグ別、期間ごとのタグ付け率をまとめた辞書。
+        """
+        period_keys = {
+            "day": lambda day: day,
+            "week": lambda day: "{0}-W{1:02d}".format(*datetime.strptime(day, "%Y-%m-%d").isocalendar()),
+            "month": lambda day: day[:7],
+        }
+        period_key = period_keys[period]
+
+        scope = "start_date BETWEEN ? AND ? AND duration > 0"
+        params = [str(first_date), str(last_date)]
+        if workspace_id:
+            scope = "workspace_id = ? AND " + scope
+            params.insert(0, str(workspace_id))
+
+        with self._lock:
+            by_day = self._conn.execute(
+                f"SELECT start_date, COUNT(*), SUM(duration), SUM(tagged * duration) "
+                f"FROM entries WHERE {scope} GROUP BY start_date ORDER BY start_date", params
+            ).fetchall()
+            by_project = self._conn.execute(
+                f"SELECT project_id, SUM(duration), SUM(tagged * duration) "
+                f"FROM entries WHERE {scope} GROUP BY project_id", params
+            ).fetchall()
+            by_tag = self._conn.execute(
+                f"SELECT tag, SUM(duration) FROM entry_tags WHERE {scope} GROUP BY tag ORDER BY 2 DESC LIMIT ?",
+                params + [top]
+            ).fetchall()
+            project_names = dict(self._conn.execute(
+                "SELECT project_id, name FROM projects" + (" WHERE workspace_id = ?" if workspace_id else ""),
+                params[:1] if workspace_id else []
+            ).fetchall())
+
+        periods = {}
+        for day, _, seconds, tagged in by_day:
+            bucket = periods.setdefault(period_key(day), [0, 0])
+            bucket[0] += seconds
+            bucket[1] += tagged
+
+        top_projects = sorted(by_project, key=lambda row: row[1], reverse=True)[:top]
+        return {
+            "entries": sum(row[1] for row in by_day),
+            "total_seconds": sum(row[2] for row in by_day),
+            "tagged_seconds": sum(row[3] for row in by_day),
+            "by_project": [
+                {
+                    "project": project_names.get(project_id, f"Project {project_id}") if project_id else "(no project)",
+                    "seconds": seconds,
+                    "tagged_seconds": tagged
+                }
+                for project_id, seconds, tagged in top_projects
+            ],
+            "by_tag": [{"tag": tag, "seconds": seconds} for tag, seconds in by_tag],
+            "by_period": [
+                {"period": key, "seconds": seconds, "tagged_seconds": tagged}
+                for key, (seconds, tagged) in periods.items()
+            ],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# バルク更新APIで一度に指定できるタイムエントリーIDの上限
+BULK_UPDATE_CHUNK_SIZE = 100
+
+def bulk_update_tags(workspace_id, auth_header, updates, concurrency=1, on_chunk_done=None, op="add"):
+    """タグ更新をバルクPATCHでまとめて送信し、エントリーごとの結果を返す
+
+    updates は {"entry": ..., "tags": [...]} のリスト。
+    戻り値は updates と同じ順序の結果リスト。
+    concurrency が2以上ならチャンクを並行して送信する。
+    on_chunk_done を渡すと、チャンクごとに (update, result) のリストを渡して呼び出す。
+    op に "replace" を指定すると、タグを追加する代わりに置き換える。
+    """
+    results = [None] * len(updates)
+
+    # 付与するタグの組み合わせごとにグループ化（同じパッチ内容のものだけまとめられる）
+    groups = {}
+    for index, update in enumerate(updates):
+        groups.setdefault(tuple(update['tags']), []).append(index)
+
+    chunks = []
+    for tags, indices in groups.items():
+        for chunk_start in range(0, len(indices), BULK_UPDATE_CHUNK_SIZE):
+            chunks.append((tags, indices[chunk_start:chunk_start + BULK_UPDATE_CHUNK_SIZE]))
+
+    def send_chunk(chunk_item):
+        send_chunk_request(chunk_item)
+        if on_chunk_done is not None:
+            on_chunk_done([(updates[i], results[i]) for i in chunk_item[1]])
+
+    def send_chunk_request(chunk_item):
+        tags, chunk = chunk_item
+        entry_ids = [updates[i]['entry']['id'] for i in chunk]
+        ids_param = ','.join(str(entry_id) for entry_id in entry_ids)
+        patch_url = f"{API_BASE_URL}/workspaces/{workspace_id}/time_entries/{ids_param}"
+        patch_data = [{"op": op, "path": "/tags", "value": list(tags)}]
+
+        try:
+            response = make_request_with_retry('PATCH', patch_url, auth_header, json=patch_data)
+        except requests.exceptions.RequestException as e:
+            for i in chunk:
+                results[i] = {"status": "network_error", "error_message": str(e)}
+            return
+
+        if response.status_code != 200:
+            for i in chunk:
+                results[i] = {
+                    "status": "failed",
+                    "error_code": response.status_code,
+                    "error_reason": response.reason
                 }
-                success += 1
+            return
+
+        # レスポンスの success / failure をエントリーIDごとに振り分ける
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        succeeded_ids = {str(entry_id) for entry_id in body.get('success') or []}
+        failure_messages = {
+            str(failure.get('id')): failure.get('message', 'Unknown error')
+            for failure in body.get('failure') or []
+        }
+
+        for i, entry_id in zip(chunk, entry_ids):
+            if str(entry_id) in succeeded_ids:
+                results[i] = {"status": "success"}
             else:
-                # 実際に更新する
-                try:
-                    update_response = make_request_with_retry('PUT', update_url, auth_header, json=update_data)
-                except requests.exceptions.RequestException as e:
-                    failed += 1
-                    print(f"❌ {project_name} Network error: {e}")
-                    log_entry = {
-                        "timestamp": now_local.isoformat(),
-                        "status": "network_error",
-                        "entry_id": entry['id'],
-                        "project_name": project_name,
-                        "description": entry.get('description', ''),
-                        "error_message": str(e)
-                    }
-                    log_entries.append(log_entry)
-                    continue
-            
-                if update_response.status_code == 200:
-                    success += 1
-                    print(f"✅ {project_name} -> {tags_to_add}")
-                    log_entry = {
-                        "timestamp": now_local.isoformat(),
-                        "status": "success",
-                        "entry_id": entry['id'],
-                        "project_name": project_name,
-                        "description": entry.get('description', ''),
-                        "start": entry.get('start', ''),
-                        "duration": entry.get('duration', 0),
-                        "tags_added": tags_to_add
-                    }
-                else:
-                    failed += 1
-                    print(f"❌ {project_name} {update_response.status_code} {update_response.reason}")
-                    log_entry = {
-                        "timestamp": now_local.isoformat(),
-                        "status": "failed",
-                        "entry_id": entry['id'],
-                        "project_name": project_name,
-                        "description": entry.get('description', ''),
-                        "error_code": update_response.status_code,
-                        "error_reason": update_response.reason
-                    }
-            
-            log_entries.append(log_entry)
+                results[i] = {
+                    "status": "failed",
+                    "error_code": response.status_code,
+                    "error_reason": failure_messages.get(str(entry_id), 'Not reported in bulk response')
+                }
 
-        print(f"\n📈 Summary for {target_date}:")
-        print(f"   Total entries: {len(entries)}")
-        print(f"   Processed: {processed}")
-        if args.dry_run:
-            print(f"   Would be updated: {success}")
-            print(f"   Failed: {failed}")
+    run_concurrently(send_chunk, chunks, concurrency)
+    return results
+
+def match_tags(tag_rules, tag_index, entry, project_name):
+    """ルールでエントリーに付けるタグを決め、ワークスペースでの表記にそろえて返す。一致しなければ None"""
+    matched_tags = tag_rules.match(entry, project_name)
+    if matched_tags is not None and tag_index is not None:
+        matched_tags = tag_index.canonical(matched_tags)
+    return matched_tags
+
+def apply_tag_updates(workspace_id, auth_header, target_date, pending_updates, concurrency=1,
+                      snapshot_store=None, snapshot_run=None, journal=None, mirror=None):
+    """1日分のタグ更新をバルクで適用し、結果のリストを返す
+
+    送信前に変更前のタグ（snapshot_store）と計画（journal）を記録し、
+    成功した更新はローカルミラーにも反映する。通常の実行と Webhook の両方から使う。
+    """
+    metrics = get_metrics()
+    on_chunk_done = None
+    with metrics.span('snapshot_and_journal'):
+        if snapshot_store is not None:
+            # 送信前に変更前のタグを保存しておく
+            snapshot_store.record(snapshot_run, target_date, pending_updates)
+        if journal is not None:
+            # 送信前に計画を、チャンクごとに結果を記録しておく
+            journal.record_planned(target_date, pending_updates)
+            on_chunk_done = journal.record_results
+    with metrics.span('bulk_update'):
+        results = bulk_update_tags(workspace_id, auth_header, pending_updates, concurrency, on_chunk_done)
+    if mirror is not None:
+        with metrics.span('local_mirror'):
+            mirror.set_tags({
+                update['entry']['id']: (update['entry'].get('tags') or []) + update['tags']
+                for update, result in zip(pending_updates, results)
+                if result['status'] == 'success'
+            })
+    return results
+
+def log_update_results(log_writer, target_date, pending_updates, results, timestamp, source=None):
+    """更新結果を1件ずつ表示して変更ログに書き、(成功件数, 失敗件数) を返す"""
+    success = failed = 0
+    for update, result in zip(pending_updates, results):
+        entry = update['entry']
+        project_name = update['project_name']
+        tags_to_add = update['tags']
+
+        if result['status'] == 'success':
+            success += 1
+            print(f"✅ {project_name} -> {tags_to_add}")
+            log_entry = {
+                "timestamp": timestamp,
+                "status": "success",
+                "entry_id": entry['id'],
+                "project_name": project_name,
+                "description": entry.get('description', ''),
+                "start": entry.get('start', ''),
+                "duration": entry.get('duration', 0),
+                "tags_added": tags_to_add
+            }
+        elif result['status'] == 'network_error':
+            failed += 1
+            print(f"❌ {project_name} Network error: {result['error_message']}")
+            log_entry = {
+                "timestamp": timestamp,
+                "status": "network_error",
+                "entry_id": entry['id'],
+                "project_name": project_name,
+                "description": entry.get('description', ''),
+                "error_message": result['error_message']
+            }
         else:
-            print(f"   Success: {success}")
-            print(f"   Failed: {failed}")
+            failed += 1
+            print(f"❌ {project_name} {result['error_code']} {result['error_reason']}")
+            log_entry = {
+                "timestamp": timestamp,
+                "status": "failed",
+                "entry_id": entry['id'],
+                "project_name": project_name,
+                "description": entry.get('description', ''),
+                "error_code": result['error_code'],
+                "error_reason": result['error_reason']
+            }
 
-        # ログディレクトリの作成
-        log_dir = "logs"
-        os.makedirs(log_dir, exist_ok=True)
+        if source:
+            log_entry["source"] = source
+        log_writer.write({"type": "change", "target_date": str(target_date), **log_entry})
+    return success, failed
 
-        # 実行時刻をファイル名に含める（JST）
-        execution_time = now_local.strftime("%Y%m%d_%H%M%S")
-        log_filename = os.path.join(log_dir, f"toggl_tag_log_{target_date}_{execution_time}.json")
-        with open(log_filename, 'w', encoding='utf-8') as f:
-            json.dump({
-                "execution_date": now_local.isoformat(),
-                "target_date": str(target_date),
-                "summary": {
-                    "total_entries": len(entries),
-                    "processed": processed,
-                    "success": success,
-                    "failed": failed
-                },
-                "changes": log_entries
-            }, f, indent=2, ensure_ascii=False)
-        print(f"📝 Log saved to: {log_filename}")
-        
-        # キャッシュ統計の表示
-        if project_cache:
-            print(f"💾 Project cache: {len(project_cache)} projects cached")
+def build_auth_header(api_token):
+    """APIトークンからBasic認証ヘッダーを作る"""
+    return {
+        "Authorization": f"Basic {b64encode(f'{api_token}:api_token'.encode()).decode()}"
+    }
+
+def undo_run(args, account, auth_header, token_key, snapshot_store, concurrency=1, log_dir=LOG_DIR, mirror=None):
+    """実行IDのスナップショットをもとに、その実行で追加したタグを元に戻す
+
+    スナップショットは日付の範囲ごとに読み出し、対象期間のエントリーを取得して照合する。
+    実行後にタグが変更されたエントリーは上書きせずにスキップする。
+    """
+    run_id = args.undo
+    workspace_id = str(account['workspace_id'])
+    run = snapshot_store.find_run(run_id, token_key, workspace_id)
+    if run is None:
+        print(f"❌ Error: Run {run_id} not found for workspace {workspace_id}")
+        recent_runs = snapshot_store.recent_runs(token_key, workspace_id)
+        if recent_runs:
+            print("   💡 Recent runs:")
+            for recent in recent_runs:
+                undone = f" (undone at {recent['undone_at']})" if recent['undone_at'] else ""
+                print(f"      {recent['run_id']}  started {recent['started_at']}{undone}")
+        return {"status": "error", "error": f"Run {run_id} not found"}
+    if run['undone_at']:
+        print(f"❌ Error: Run {run_id} was already undone at {run['undone_at']}")
+        return {"status": "error", "error": f"Run {run_id} already undone"}
+
+    print(f"↩️  Undoing run {run_id} (started {run['started_at']}, {run['entries']} entries)")
+    run_tz = ZoneInfo(run['timezone'])
+    now_local = datetime.now(run_tz)
+    totals = {"dates": 0, "total_entries": run['entries'], "processed": 0, "success": 0, "failed": 0}
+    skipped_changed = 0
+    already_original = 0
+    log_writer = RunLogWriter(log_dir)
+
+    # 取得APIの期間上限ごとにスナップショットを読み出して照合する（全件をメモリに載せない）
+    snapshot_dates = snapshot_store.snapshot_dates(run_id, token_key, workspace_id)
+    for window in split_fetch_windows(snapshot_dates):
+        entries_by_date, failed_dates = fetch_time_entries_by_date(auth_header, run_tz, window)
+        current_entries = {entry['id']: entry for entries in entries_by_date.values() for entry in entries}
+        totals["dates"] += len(window)
+
+        reverts = []
+        for target_date, entry_id, original_tags, applied_tags in snapshot_store.iter_snapshots(
+                run_id, token_key, workspace_id, window[0], window[-1]):
+            if target_date in failed_dates:
+                totals["failed"] += 1
+                continue
+            entry = current_entries.get(entry_id)
+            current_tags = sorted(entry.get('tags') or []) if entry else None
+            if current_tags == sorted(original_tags):
+                # 更新が失敗していたか、すでに元に戻されている
+                already_original += 1
+                continue
+            if current_tags != sorted(applied_tags):
+                # 実行後に削除・編集されたエントリーは上書きしない
+                skipped_changed += 1
+                print(f"⚠️  Skipped entry {entry_id}: changed since run {run_id}")
+                log_writer.write({"type": "undo", "run_id": run_id, "status": "skipped_changed",
+                                  "entry_id": entry_id, "target_date": str(target_date)})
+                continue
+            reverts.append({"entry": entry, "tags": original_tags, "target_date": target_date})
+
+        totals["processed"] += len(reverts)
+        if not reverts:
+            continue
+        if args.dry_run:
+            for update in reverts:
+                print(f"🔍 [DRY RUN] {update['entry'].get('description', '')} -> {update['tags']}")
+            totals["success"] += len(reverts)
+            continue
+
+        results = bulk_update_tags(workspace_id, auth_header, reverts, concurrency, op="replace")
+        if mirror is not None:
+            mirror.set_tags({
+                update['entry']['id']: update['tags']
+                for update, result in zip(reverts, results)
+                if result['status'] == 'success'
+            })
+        for update, result in zip(reverts, results):
+            log_entry = {
+                "type": "undo",
+                "run_id": run_id,
+                "timestamp": now_local.isoformat(),
+                "status": "reverted" if result['status'] == 'success' else result['status'],
+                "entry_id": update['entry']['id'],
+                "target_date": str(update['target_date']),
+                "restored_tags": update['tags']
+            }
+            if result['status'] == 'success':
+                totals["success"] += 1
+            else:
+                totals["failed"] += 1
+                error = result.get('error_message') or f"{result['error_code']} {result['error_reason']}"
+                print(f"❌ Entry {update['entry']['id']}: {error}")
+                log_entry["error"] = error
+            log_writer.write(log_entry)
+
+    log_writer.close()
+
+    print(f"\n📈 Undo summary for run {run_id}:")
+    print(f"   Snapshots: {run['entries']}")
+    if args.dry_run:
+        print(f"   Would be reverted: {totals['success']}")
+    else:
+        print(f"   Reverted: {totals['success']}")
+    print(f"   Already original: {already_original}")
+    print(f"   Skipped (changed since run): {skipped_changed}")
+    print(f"   Failed: {totals['failed']}")
+
+    if not args.dry_run and not totals["failed"]:
+        snapshot_store.mark_undone(run_id, token_key, workspace_id, now_local.isoformat())
+
+    rate_limiter = get_rate_limiter(auth_header['Authorization'])
+    return {"status": "ok", "throttled_seconds": rate_limiter.throttled_seconds, **totals}
+
+def process_account(args, account, tag_rules, metadata_cache=None, concurrency=1,
+                    load_project_cache=None, log_dir=LOG_DIR, snapshot_store=None, run_id=None, mirror=None,
+                    revalidate=True, log_writer=None):
+    """1つのアカウント（APIトークン×ワークスペース）のエントリーを処理する
+
+    account は {"api_token", "workspace_id", "timezone"} を持つ辞書。
+    load_project_cache を渡すと、アクセス検証後にそれを呼んでプロジェクト一覧を取得する
+    （同じワークスペースのユーザー間で一覧を共有するため）。
+    snapshot_store を渡すと、更新前のタグを run_id で保存する（--undo で取り消せる）。
+    mirror を渡すと、取得したエントリーと更新後のタグをローカルミラーに保存する。
+    revalidate が False ならAPIアクセスの検証を省略する（常駐モードで検証済みの場合）。
+    log_writer を渡すとそれに変更ログを書く（同じログファイルを複数のライターで開くと、
+    ローテーション時に書き込みが失われるため）。渡さなければ log_dir に書いて最後に閉じる。
+    戻り値は処理結果の集計。致命的なエラーのときは status が "error" になる。
+    """
+    api_token = account['api_token']
+    workspace_id = account['workspace_id']
+    timezone = account['timezone']
+    user_tz = ZoneInfo(timezone)
+    auth_header = build_auth_header(api_token)
+    # キャッシュのキーにはトークンそのものではなくハッシュを使う
+    token_key = hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+    metrics = get_metrics()
+
+    # APIアクセスの検証
+    if revalidate:
+        with metrics.span('validate_api_access'):
+            api_access_valid = validate_api_access(workspace_id, auth_header, metadata_cache, token_key)
+        if not api_access_valid:
+            return {"status": "error", "error": "API access validation failed"}
+
+    if args.undo:
+        with metrics.span('undo'):
+            return undo_run(args, account, auth_header, token_key, snapshot_store, concurrency, log_dir, mirror)
+
+    now_local = datetime.now(user_tz)
+    snapshot_run = {
+        "run_id": run_id,
+        "token_key": token_key,
+        "workspace_id": str(workspace_id),
+        "timezone": timezone,
+        "started_at": now_local.isoformat()
+    }
+    
+    # プロジェクト情報のキャッシュ（起動時にワークスペースの全プロジェクトを読み込む）
+    with metrics.span('project_catalog'):
+        if load_project_cache is not None:
+            # 共有の一覧はコピーして使う（権限がなく取得できなかったプロジェクトを他のユーザーに広げない）
+            project_cache = dict(load_project_cache())
+        else:
+            project_cache = fetch_project_catalog(workspace_id, auth_header, metadata_cache)
+    project_cache_stats = {"hits": 0, "misses": 0}
+    
+    # 設定ファイルのタグをワークスペースのタグ一覧と照合し、ないタグは実行前にまとめて作成する
+    with metrics.span('workspace_tags'):
+        tags_ready, tag_index = prepare_workspace_tags(
+            args, workspace_id, auth_header, sorted(tag_rules.all_tags()), metadata_cache, concurrency
+        )
+    if not tags_ready:
+        return {"status": "error", "error": "Tags missing from workspace"}
+    
+    # インタラクティブモード用の全タグリスト
+    all_used_tags = collect_all_used_tags(tag_rules) if args.interactive else set()
+    if tag_index is not None:
+        all_used_tags = set(tag_index.canonical(all_used_tags))
+    
+    # 中断された実行のジャーナル（dry-run では読み込むだけで書き込まない）
+    journal_path = CheckpointJournal.path_for(token_key, workspace_id)
+    journal = None
+    
+    # 処理する日付を決定
+    if args.resume:
+        # 前回の実行で処理し終えていない日付だけを処理する
+        journal = CheckpointJournal.load(journal_path, read_only=args.dry_run)
+        if journal is None:
+            print("ℹ️  No interrupted run found, nothing to resume")
+            return {"status": "ok", "throttled_seconds": 0.0, "dates": 0, "total_entries": 0,
+                    "processed": 0, "success": 0, "failed": 0}
+        dates_to_process = journal.pending_dates()
+        if journal.run_id:
+            # 再開した分のスナップショットも元の実行IDにまとめ、--undo で一度に取り消せるようにする
+            run_id = snapshot_run['run_id'] = journal.run_id
+        print(f"♻️  Resuming run {run_id} started at {journal.started_at}: "
+              f"{len(dates_to_process)} of {len(journal.dates)} dates left, "
+              f"{len(journal.applied)} updates already applied")
+    elif args.date:
+        # 指定された日付を使用（形式は main で検証済み）
+        dates_to_process = [datetime.strptime(args.date, "%Y-%m-%d").date()]
+    elif args.today:
+        # 今日を処理
+        dates_to_process = [now_local.date()]
+    elif args.days:
+        # 過去N日分を処理
+        dates_to_process = [now_local.date() - timedelta(days=i) for i in range(args.days)]
+    elif args.incremental:
+        # 差分同期: 取得したエントリーの日付を処理
+        dates_to_process = []
+    else:
+        # デフォルト: 昨日を処理
+        dates_to_process = [now_local.date() - timedelta(days=1)]
+    
+    if journal is None and not args.incremental and not args.dry_run:
+        # 新しい実行を開始する（中断された実行が残っていれば置き換える）
+        if os.path.exists(journal_path):
+            print("⚠️  Warning: Discarding an interrupted run; use --resume to continue it instead")
+        journal = CheckpointJournal(journal_path)
+        journal.start(dates_to_process, now_local.isoformat(), run_id)
+    
+    if args.incremental:
+        # 前回の同期時刻以降に変更されたエントリーだけを取得する
+        sync_key = f"{token_key}:{workspace_id}"
+        last_synced_at = load_sync_state().get(sync_key)
+        sync_started_at = time.time()
+        if last_synced_at is None:
+            print("ℹ️  No previous sync found, checking entries changed in the last 2 days")
+            since = sync_started_at - INCREMENTAL_INITIAL_LOOKBACK_SECONDS
+        else:
+            since = last_synced_at - INCREMENTAL_SYNC_OVERLAP_SECONDS
+            print(f"🔄 Fetching entries changed since {datetime.fromtimestamp(since, user_tz).isoformat()}")
+
+        try:
+            with metrics.span('fetch_entries'):
+                entries_by_date, deleted_ids, response = fetch_changed_time_entries(auth_header, user_tz, since)
+                if entries_by_date is None and response.status_code == 400 and last_synced_at is not None:
+                    # 前回の同期が古すぎて since が受け付けられない場合は初回扱いでやり直す
+                    print("⚠️  Warning: Last sync is too old for incremental fetch, starting over")
+                    print("   💡 Hint: Run with --days N once to backfill older entries")
+                    since = sync_started_at - INCREMENTAL_INITIAL_LOOKBACK_SECONDS
+                    entries_by_date, deleted_ids, response = fetch_changed_time_entries(auth_header, user_tz, since)
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Failed to fetch changed time entries: Network error: {e}")
+            return {"status": "error", "error": f"Network error: {e}"}
+        except json.JSONDecodeError as e:
+            print(f"❌ Failed to fetch changed time entries: Invalid response: {e}")
+            return {"status": "error", "error": f"Invalid response: {e}"}
+
+        if entries_by_date is None:
+            print(f"❌ Failed to fetch changed time entries: {response.status_code} {response.reason}")
+            print(f"Response: {response.text}")
+            return {"status": "error", "error": f"Failed to fetch changed time entries: {response.status_code}"}
+
+        changed_count = sum(len(entries) for entries in entries_by_date.values())
+        print(f"📊 Found {changed_count} changed entries ({len(deleted_ids)} deleted)")
+        dates_to_process = sorted(entries_by_date, reverse=True)
+        if mirror is not None:
+            with metrics.span('local_mirror'):
+                mirror.store(workspace_id, entries_by_date, project_cache, replace_dates=False, user_key=token_key)
+                mirror.delete(deleted_ids)
+        fetched_windows = [(entries_by_date, {})]
+    else:
+        # 対象期間のエントリーを取得APIの期間上限ごとに取得し、1期間ずつ最後まで処理する
+        # （期間を長くしてもメモリに載るエントリーは1期間分だけ）
+        fetched_windows = iter_time_entry_windows(auth_header, user_tz, dates_to_process)
+    
+    totals = {"dates": 0, "total_entries": 0, "processed": 0, "success": 0, "failed": 0}
+    
+    # 変更ログはJSON Lines形式で1件ずつ追記する（途中で落ちても書いた分は残る）
+    owns_log_writer = log_writer is None
+    if owns_log_writer:
+        log_writer = RunLogWriter(log_dir)
+    
+    prefetch_executor = update_executor = None
+    if args.interactive:
+        # インタラクティブモードでは入力を待つ間に、後続のエントリーのプロジェクトを裏で取得しておく
+        prefetch_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='prefetch')
+        # 選んだタグの送信も裏で1日分ずつ順番に行う
+        update_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-update')
+        # タグ候補は実際の使用履歴から作る（ミラーがなければ取得したエントリーから集める）
+        tag_history = TagHistory()
+        if mirror is not None:
+            tag_history.load_mirror(mirror, workspace_id, now_local.date() - timedelta(days=TAG_HISTORY_DAYS))
+
+    def prefetch_projects(entries_by_date, window_dates):
+        """一覧になかったプロジェクトを先に取得する。インタラクティブモードでは取得中の Future を返す"""
+        unknown_project_ids = list(dict.fromkeys(
+            entry.project_id
+            for target_date in window_dates
+            for entry in entries_by_date.get(target_date, [])
+            if not entry.tags and entry.project_id and entry.project_id not in project_cache
+        ))
+        if args.interactive:
+            return {
+                project_id: prefetch_executor.submit(
+                    resolve_project_name, workspace_id, auth_header, project_cache, project_id, metadata_cache,
+                    project_cache_stats
+                )
+                for project_id in unknown_project_ids
+            }
+        if concurrency > 1:
+            # 並行モードでは、一覧になかったプロジェクトを先にまとめて並行取得しておく
+            with metrics.span('project_lookups'):
+                run_concurrently(
+                    lambda project_id: resolve_project_name(
+                        workspace_id, auth_header, project_cache, project_id, metadata_cache, project_cache_stats
+                    ),
+                    unknown_project_ids,
+                    concurrency
+                )
+        return {}
+
+    def entries_to_tag(entries, prefetched_projects):
+        """タグのないエントリーを、解決したプロジェクト名と組にして順に返す"""
+        for entry in entries:
+            if entry.tags:
+                continue
+            if not entry.project_id:
+                # プロジェクトのないエントリーも、プロジェクト条件のないルールの対象にする
+                if tag_rules.unscoped_rules:
+                    yield entry, None
+                continue
+            # プロジェクト名をキャッシュから取得、なければAPIで取得（先読み済みならその結果を待つ）
+            if entry.project_id in prefetched_projects:
+                project_name = prefetched_projects[entry.project_id].result()
+            else:
+                project_name = resolve_project_name(
+                    workspace_id, auth_header, project_cache, entry.project_id, metadata_cache, project_cache_stats
+                )
+            if project_name is not None:
+                yield entry, project_name
+
+    def send_updates(target_date, pending_updates):
+        return apply_tag_updates(workspace_id, auth_header, target_date, pending_updates, concurrency,
+                                 snapshot_store, snapshot_run, journal, mirror)
+
+    def finish_date(target_date, total_entries, processed, success, pending_updates, results):
+        """更新結果をログに書き、日付ごとのサマリーを表示する"""
+        applied, failed = log_update_results(log_writer, target_date, pending_updates, results, now_local.isoformat())
+        success += applied
+
+        print(f"\n📈 Summary for {target_date}:")
+        print(f"   Total entries: {total_entries}")
+        print(f"   Processed: {processed}")
+        if args.dry_run:
+            print(f"   Would be updated: {success}")
+            print(f"   Failed: {failed}")
+        else:
+            print(f"   Success: {success}")
+            print(f"   Failed: {failed}")
+        totals["dates"] += 1
+        totals["total_entries"] += total_entries
+        totals["processed"] += processed
+        totals["success"] += success
+        totals["failed"] += failed
+
+        log_writer.write({
+            "type": "summary",
+            "execution_date": now_local.isoformat(),
+            "target_date": str(target_date),
+            "summary": {
+                "total_entries": total_entries,
+                "processed": processed,
+                "success": success,
+                "failed": failed
+            }
+        })
+        # 失敗した更新が残る日付は --resume で再試行できるよう完了扱いにしない
+        if journal is not None and not failed:
+            journal.record_date_done(target_date)
+        print(f"📝 Log appended to: {log_writer.path}")
+        
+        # キャッシュ統計の表示
+        cached_projects = sum(1 for name in project_cache.values() if name is not None)
+        if cached_projects:
+            print(f"💾 Project cache: {cached_projects} projects cached "
+                  f"({project_cache_stats['hits']} hits, {project_cache_stats['misses']} misses)")
+
+    # インタラクティブモードで裏で送信中の更新（結果は最後にまとめて表示する）
+    queued_dates = []
+    
+    # 取得した期間ごとに、各日付を処理
+    for entries_by_date, failed_dates in fetched_windows:
+        window_dates = [target_date for target_date in dates_to_process if target_date in entries_by_date]
+        if mirror is not None and not args.incremental:
+            # 取得に成功した日付はミラーの内容を丸ごと置き換える
+            with metrics.span('local_mirror'):
+                mirror.store(workspace_id, {
+                    target_date: entries for target_date, entries in entries_by_date.items()
+                    if target_date not in failed_dates
+                }, project_cache, user_key=token_key)
+        prefetched_projects = prefetch_projects(entries_by_date, window_dates)
+        if args.interactive and mirror is None:
+            for entries in entries_by_date.values():
+                for entry in entries:
+                    tag_history.add(entry.project_id, entry.tags)
+
+        for target_date in window_dates:
+            print(f"\n{'='*50}")
+            print(f"🔍 Processing date: {target_date} ({timezone})")
+            print(f"{'='*50}")
+            
+            if target_date in failed_dates:
+                print(f"❌ Failed to fetch time entries: {failed_dates[target_date]}")
+                continue
+
+            entries = entries_by_date[target_date]
+            print(f"📊 Found {len(entries)} time entries")
+
+            processed = 0
+            success = 0
+
+            pending_updates = []
+            evaluate_started = time.perf_counter()
+            planned = journal.planned_for(target_date) if journal is not None else None
+
+            # タグのないエントリー → プロジェクト名の解決 → タグの決定、の順に1件ずつ流す
+            for entry, project_name in entries_to_tag(entries, prefetched_projects):
+                # タグの決定（ワークスペースでの表記にそろえる）
+                matched_tags = match_tags(tag_rules, tag_index, entry, project_name)
+                suggested_tags = matched_tags or []
+                if planned is not None:
+                    # 中断前に計画済みの日付は、その計画のうち未適用の更新だけをやり直す
+                    if entry.id not in planned:
+                        continue
+                    matched_tags = planned[entry.id]
+                    project_name = project_name or NO_PROJECT_LABEL
+                if project_name is None:
+                    if matched_tags is None:
+                        continue
+                    project_name = NO_PROJECT_LABEL
+                
+                # 中断前の実行で適用済みの更新はやり直さない
+                if journal is not None and matched_tags is not None and journal.is_applied(entry.id, matched_tags):
+                    continue
+                
+                if planned is not None:
+                    # 計画したタグをそのまま使う（インタラクティブモードでも選び直さない）
+                    tags_to_add = matched_tags
+                elif args.interactive:
+                    # インタラクティブモード: ユーザーがタグを選択
+                    frequent_tags = tag_history.suggestions(entry.project_id, fallback=all_used_tags)
+                    selected_tags = interactive_tag_selection(entry, project_name, suggested_tags, frequent_tags)
+                    if selected_tags is None:
+                        print("⏭️  Skipped")
+                        continue
+                    tags_to_add = selected_tags
+                    if tag_index is not None:
+                        # 入力されたタグも照合し、ワークスペースにないタグはその場で作成する
+                        tags_to_add = tag_index.canonical(tags_to_add)
+                        new_tags = tag_index.missing(tags_to_add)
+                        if new_tags and args.no_create_tags:
+                            print(f"❌ Tags not in workspace: {', '.join(new_tags)} (skipped, --no-create-tags)")
+                            continue
+                        if new_tags and args.dry_run:
+                            print(f"🔍 [DRY RUN] New tags would be created: {', '.join(new_tags)}")
+                        elif new_tags:
+                            create_workspace_tags(workspace_id, auth_header, tag_index, new_tags)
+                    tag_history.add(entry.project_id, tags_to_add)
+                else:
+                    # 通常モード: 設定ファイルのマッピングに従う
+                    if matched_tags is None:
+                        continue
+                    tags_to_add = suggested_tags
+                
+                processed += 1
+                
+                if args.dry_run:
+                    # Dry-runモードでは実際に更新しない
+                    print(f"🔍 [DRY RUN] {project_name} -> {tags_to_add}")
+                    log_entry = {
+                        "timestamp": now_local.isoformat(),
+                        "status": "dry_run",
+                        "entry_id": entry.id,
+                        "project_name": project_name,
+                        "description": entry.get('description', ''),
+                        "start": entry.get('start', ''),
+                        "duration": entry.get('duration', 0),
+                        "tags_to_add": tags_to_add
+                    }
+                    success += 1
+                    log_writer.write({"type": "change", "target_date": str(target_date), **log_entry})
+                else:
+                    # 実際の更新はバルクPATCHでまとめて送信する
+                    pending_updates.append({
+                        "entry": entry,
+                        "project_name": project_name,
+                        "tags": tags_to_add
+                    })
+
+            # インタラクティブモードでは入力待ちの時間も含まれる
+            metrics.add_timing('evaluate_entries', time.perf_counter() - evaluate_started)
+
+            if args.interactive and pending_updates:
+                # 選んだタグは裏でまとめて送信し、次の日付の選択に進む
+                future = update_executor.submit(send_updates, target_date, pending_updates)
+                print(f"📤 Queued {len(pending_updates)} updates for {target_date}, sending in the background")
+                queued_dates.append((target_date, len(entries), processed, success, pending_updates, future))
+                continue
+
+            results = send_updates(target_date, pending_updates) if pending_updates else []
+            finish_date(target_date, len(entries), processed, success, pending_updates, results)
+
+    if args.interactive:
+        prefetch_executor.shutdown(wait=True)
+        if queued_dates:
+            print(f"\n⏳ Waiting for {sum(len(item[4]) for item in queued_dates)} queued updates...")
+        for target_date, total_entries, processed, success, pending_updates, future in queued_dates:
+            print(f"\n{'='*50}")
+            print(f"📤 Results for {target_date}")
+            print(f"{'='*50}")
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{"status": "network_error", "error_message": str(e)}] * len(pending_updates)
+            finish_date(target_date, total_entries, processed, success, pending_updates, results)
+        update_executor.shutdown(wait=True)
+
+    if owns_log_writer:
+        log_writer.close()
+
+    if snapshot_store is not None and totals["success"]:
+        print(f"🗂️  Snapshot saved as run {run_id} (revert with --undo {run_id})")
+
+    if journal is not None and not args.dry_run:
+        if journal.pending_dates():
+            print(f"⚠️  {len(journal.pending_dates())} dates did not finish, run with --resume to retry them")
+        else:
+            journal.finish()
+
+    # 差分同期の同期時刻を更新（失敗したエントリーがあれば次回もう一度取得する）
+    if args.incremental and not args.dry_run:
+        if totals["failed"]:
+            print(f"⚠️  {totals['failed']} updates failed, keeping previous sync point so they are retried next run")
+        else:
+            save_sync_point(sync_key, sync_started_at)
+
+    for key in ('processed', 'success', 'failed'):
+        metrics.increment(f'entries_{key}', totals[key])
+
+    rate_limiter = get_rate_limiter(auth_header['Authorization'])
+    return {"status": "ok", "throttled_seconds": rate_limiter.throttled_seconds, **totals}
+
+# フリートモードで同時に処理するユーザー数のデフォルト
+DEFAULT_FLEET_WORKERS = 4
+
+def load_fleet_manifest(manifest_path, default_timezone):
+    """フリートモードのマニフェストを読み込み、アカウントのリストを返す
+
+    トークンはマニフェストに直接書く（token）か、環境変数名で指定する（token_env）。
+    問題があれば None を返す。
+    """
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        print(f"❌ Error: {manifest_path} not found")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"❌ Error: Invalid JSON in {manifest_path}")
+        print(f"   💡 Hint: Check JSON syntax at line {e.lineno}, column {e.colno}")
+        return None
+
+    users = manifest.get('users') if isinstance(manifest, dict) else None
+    if not isinstance(users, list) or not users:
+        print(f"❌ Error: {manifest_path} must contain a non-empty \"users\" list")
+        return None
+
+    accounts = []
+    names = set()
+    for index, user in enumerate(users, 1):
+        if not isinstance(user, dict):
+            print(f"❌ Error: User #{index} in {manifest_path} must be an object")
+            return None
+
+        name = str(user.get('name') or f"user{index}")
+        if name in names:
+            print(f"❌ Error: Duplicate user name '{name}' in {manifest_path}")
+            return None
+        names.add(name)
+
+        api_token = user.get('token') or (os.getenv(user['token_env']) if user.get('token_env') else None)
+        if not api_token:
+            print(f"❌ Error: No API token for user '{name}'")
+            print("   💡 Hint: Set \"token\" or \"token_env\" (name of an environment variable) in the manifest")
+            return None
+
+        workspace_id = user.get('workspace_id')
+        if not workspace_id:
+            print(f"❌ Error: No workspace_id for user '{name}'")
+            return None
+
+        timezone = user.get('timezone', default_timezone)
+        try:
+            ZoneInfo(timezone)
+        except Exception:
+            print(f"❌ Error: Invalid timezone '{timezone}' for user '{name}'")
+            return None
+
+        accounts.append({
+            "name": name,
+            "api_token": api_token,
+            "workspace_id": str(workspace_id),
+            "timezone": timezone
+        })
+
+    return accounts
+
+class ThreadOutputRouter:
+    """ワーカーごとに print の出力を振り分ける sys.stdout の代わり
+
+    ワーカースレッドの出力はバッファに溜め、ユーザーごとにまとめて表示できるようにする。
+    バッファはコンテキスト変数で持つので、ワーカーが run_concurrently（asyncio.to_thread）で
+    起動した内側のスレッドの出力も同じユーザーのバッファに入る。
+    キャプチャしていないスレッドの出力はそのまま元の stdout に書く。
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar('fleet_output_buffer', default=None)
+        self.lock = threading.Lock()
+
+    def capture(self):
+        self.buffer.set(io.StringIO())
+
+    def release(self):
+        buffer = self.buffer.get()
+        self.buffer.set(None)
+        with self.lock:
+            return buffer.getvalue()
+
+    def write(self, text):
+        buffer = self.buffer.get()
+        if buffer is None:
+            return self.stream.write(text)
+        # 内側のスレッドからも同時に書かれるのでロックする
+        with self.lock:
+            return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def run_fleet(args, accounts, project_tag_map, metadata_cache, concurrency, snapshot_store=None, run_id=None,
+              mirror=None):
+    """マニフェストの全ユーザーをワーカープールで処理し、集計サマリーを書き出す
+
+    同じワークスペースのユーザー同士でプロジェクト一覧を共有する。
+    レート制限はAPIトークンごとに別々に管理される。戻り値は終了コード。
+    """
+    started_at = datetime.now()
+    print(f"🚚 Fleet mode: {len(accounts)} users, {min(args.workers, len(accounts))} workers")
+
+    # タイムゾーンごとにルールをコンパイルしておく（時間帯の条件がタイムゾーンに依存するため）
+    tag_rules_by_timezone = {}
+    for account in accounts:
+        if account['timezone'] not in tag_rules_by_timezone:
+            tag_rules_by_timezone[account['timezone']] = TagRuleEngine(project_tag_map, ZoneInfo(account['timezone']))
+
+    # ワークスペースごとのプロジェクト一覧（最初に必要になったワーカーが1回だけ取得する）
+    shared_catalogs = {}
+    catalog_locks = {}
+    catalogs_lock = threading.Lock()
+
+    def get_shared_catalog(account):
+        workspace_id = account['workspace_id']
+        with catalogs_lock:
+            catalog_lock = catalog_locks.setdefault(workspace_id, threading.Lock())
+        with catalog_lock:
+            if workspace_id not in shared_catalogs:
+                auth_header = build_auth_header(account['api_token'])
+                shared_catalogs[workspace_id] = fetch_project_catalog(workspace_id, auth_header, metadata_cache)
+            return shared_catalogs[workspace_id]
+
+    router = ThreadOutputRouter(sys.stdout)
+
+    def run_worker(account):
+        router.capture()
+        try:
+            print(f"\n{'#'*50}")
+            print(f"👤 User: {account['name']} (workspace {account['workspace_id']})")
+            print(f"{'#'*50}")
+            try:
+                result = process_account(
+                    args, account, tag_rules_by_timezone[account['timezone']], metadata_cache, concurrency,
+                    load_project_cache=lambda: get_shared_catalog(account),
+                    log_dir=os.path.join(LOG_DIR, safe_file_name(account['name'])),
+                    snapshot_store=snapshot_store, run_id=run_id, mirror=mirror
+                )
+            except Exception as e:
+                print(f"❌ Unexpected error: {e}")
+                result = {"status": "error", "error": str(e)}
+        finally:
+            output = router.release()
+        return account, result, output
+
+    results = []
+    sys.stdout = router
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(run_worker, account) for account in accounts]
+            for future in as_completed(futures):
+                account, result, output = future.result()
+                router.stream.write(output)
+                router.stream.flush()
+                results.append((account, result))
+    finally:
+        sys.stdout = router.stream
+
+    # 集計サマリーの作成
+    totals = {"users": len(accounts), "errors": 0, "total_entries": 0, "processed": 0, "success": 0, "failed": 0}
+    user_summaries = []
+    for account, result in sorted(results, key=lambda item: item[0]['name']):
+        if result['status'] == 'error':
+            totals['errors'] += 1
+        for key in ('total_entries', 'processed', 'success', 'failed'):
+            totals[key] += result.get(key, 0)
+        user_summaries.append({
+            "name": account['name'],
+            "workspace_id": account['workspace_id'],
+            "timezone": account['timezone'],
+            **result
+        })
+
+    print(f"\n{'='*50}")
+    print(f"📈 Fleet summary ({len(accounts)} users)")
+    print(f"{'='*50}")
+    for summary in user_summaries:
+        if summary['status'] == 'error':
+            print(f"   ❌ {summary['name']}: {summary['error']}")
+        else:
+            print(f"   ✅ {summary['name']}: processed {summary['processed']}, success {summary['success']}, failed {summary['failed']}")
+    print(f"   Total processed: {totals['processed']}")
+    print(f"   Total success: {totals['success']}")
+    print(f"   Total failed: {totals['failed']}")
+    print(f"   Users with errors: {totals['errors']}")
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    summary_path = os.path.join(LOG_DIR, f"fleet_summary_{started_at.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "execution_date": started_at.isoformat(),
+            "dry_run": args.dry_run,
+            "totals": totals,
+            "users": user_summaries
+        }, f, indent=2, ensure_ascii=False)
+    print(f"📝 Fleet summary saved to: {summary_path}")
+
+    return 1 if totals['errors'] else 0
+
+def safe_file_name(name):
+    """ユーザー名などをファイル・ディレクトリ名に使える形にする"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+# 常駐モードのポーリング間隔のデフォルト（秒）
+DEFAULT_DAEMON_INTERVAL = 60.0
+
+# Webhook受信時の取りこぼし確認（差分同期）の間隔のデフォルト（秒）
+DEFAULT_RECONCILE_INTERVAL = 15 * 60.0
+
+# 常駐モードでAPIトークン・ワークスペースを再検証し、プロジェクト一覧を取り直す間隔（秒）
+DAEMON_REVALIDATE_SECONDS = 60 * 60
+
+# Webhook受信サーバーのデフォルトの待ち受けアドレス
+DEFAULT_WEBHOOK_HOST = "127.0.0.1"
+DEFAULT_WEBHOOK_PORT = 8780
+
+# Webhook の署名ヘッダー（本文の HMAC-SHA256）
+WEBHOOK_SIGNATURE_HEADER = "X-Webhook-Signature-256"
+
+# 受け付けるWebhook本文の最大サイズ（バイト）
+WEBHOOK_MAX_BODY_BYTES = 1024 * 1024
+
+# 未処理のイベントを溜めておける上限。溢れたら 503 を返して再送してもらう
+WEBHOOK_QUEUE_SIZE = 10000
+
+# 最後のイベントからこの秒数だけ新しいイベントが来なければバッチを処理する
+WEBHOOK_DEBOUNCE_SECONDS = 2.0
+
+# イベントが途切れなくても、最初のイベントからこの秒数でバッチを処理する
+WEBHOOK_MAX_BATCH_WAIT_SECONDS = 10.0
+
+def config_mtime(config_path):
+    try:
+        return os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def install_stop_handlers(stop_event):
+    """SIGTERM / SIGINT を受けたら stop_event をセットする（処理中のサイクルは最後まで実行する）"""
+    def request_stop(signum, frame):
+        if stop_event.is_set():
+            return
+        print(f"\n🛑 Received {signal.Signals(signum).name}, stopping after the current cycle...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+def verify_webhook_signature(secret, body, signature):
+    """X-Webhook-Signature-256 ヘッダー（"sha256=<hex>"）が本文の HMAC-SHA256 と一致するか"""
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len('sha256='):])
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """Toggl Webhook のイベントを受け取り、署名を検証してキューに積む"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        receiver = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > WEBHOOK_MAX_BODY_BYTES:
+            return self._respond(413, {"error": "Payload too large"})
+        body = self.rfile.read(length)
+
+        if not verify_webhook_signature(receiver.secret, body, self.headers.get(WEBHOOK_SIGNATURE_HEADER)):
+            receiver.count('rejected')
+            return self._respond(401, {"error": "Invalid signature"})
+
+        try:
+            event = json.loads(body)
+        except json.JSONDecodeError:
+            return self._respond(400, {"error": "Invalid JSON"})
+        if not isinstance(event, dict):
+            return self._respond(400, {"error": "Invalid event"})
+
+        # サブスクリプション作成時の検証リクエストには validation_code をそのまま返す
+        payload = event.get('payload')
+        if payload == 'ping':
+            return self._respond(200, {"validation_code": event.get('validation_code')})
+
+        metadata = event.get('metadata') or {}
+        if (metadata.get('model') != 'time_entry' or metadata.get('action') not in ('created', 'updated')
+                or not isinstance(payload, dict) or 'id' not in payload
+                or str(payload.get('workspace_id', receiver.workspace_id)) != str(receiver.workspace_id)
+                or str(payload.get('user_id')) != str(receiver.user_id)):
+            # 他のユーザーのエントリーは扱わない（通常の実行と同じく自分のエントリーだけをタグ付けする）
+            receiver.count('ignored')
+            return self._respond(202, {"status": "ignored"})
+
+        try:
+            receiver.event_queue.put_nowait(payload)
+        except queue.Full:
+            receiver.count('dropped')
+            return self._respond(503, {"error": "Queue full"})
+        receiver.count('accepted')
+        return self._respond(202, {"status": "queued"})
+
+    def _respond(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """Webhook を受け付けるHTTPサーバー。受け取ったエントリーは event_queue に積まれる
+
+    workspace_id と user_id（APIトークンのユーザー）が一致するエントリーのイベントだけを受け付ける。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, secret, workspace_id, user_id):
+        super().__init__(address, WebhookRequestHandler)
+        self.secret = secret
+        self.workspace_id = workspace_id
+        self.user_id = user_id
+        self.event_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.counts = {"accepted": 0, "ignored": 0, "rejected": 0, "dropped": 0}
+        self._counts_lock = threading.Lock()
+
+    def count(self, key):
+        with self._counts_lock:
+            self.counts[key] += 1
+        get_metrics().increment(f'webhook_events_{key}')
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='webhook-receiver', daemon=True)
+        thread.start()
+        return thread
+
+    def next_batch(self, timeout):
+        """最初のイベントを最大 timeout 秒待ち、その後は途切れるまでまとめて取り出す
+
+        同じエントリーのイベントは最新の内容だけを残す。イベントがなければ空の辞書を返す。
+        """
+        batch = {}
+        try:
+            entry = self.event_queue.get(timeout=timeout)
+        except queue.Empty:
+            return batch
+        batch[entry['id']] = entry
+        deadline = time.monotonic() + WEBHOOK_MAX_BATCH_WAIT_SECONDS
+        while len(batch) < BULK_UPDATE_CHUNK_SIZE:
+            wait = min(WEBHOOK_DEBOUNCE_SECONDS, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            try:
+                entry = self.event_queue.get(timeout=wait)
+            except queue.Empty:
+                break
+            batch[entry['id']] = entry
+        return batch
+
+def run_daemon(args, account, config_path, project_tag_map, metadata_cache=None, concurrency=1,
+               snapshot_store=None, mirror=None, receiver=None):
+    """プロセスを常駐させ、一定間隔で前回以降に変更されたエントリーを処理する
+
+    HTTPセッション・キャッシュ・プロジェクト一覧はサイクルをまたいで使い回す。
+    config.json が更新されたらルールを読み直し、APIアクセスの検証は一定間隔でのみ行う。
+    receiver（WebhookReceiver）を渡すと、ポーリングの合間に受け取ったイベントのエントリーを
+    すぐに処理し、定期的な差分同期は取りこぼしの確認として動く。
+    SIGTERM / SIGINT を受けたら実行中のサイクルを終えてから終了する。戻り値は終了コード。
+    """
+    stop_event = threading.Event()
+    install_stop_handlers(stop_event)
+
+    workspace_id = account['workspace_id']
+    user_tz = ZoneInfo(account['timezone'])
+    auth_header = build_auth_header(account['api_token'])
+    state = {
+        "tag_rules": TagRuleEngine(project_tag_map, user_tz),
+        "config_mtime": config_mtime(config_path),
+        "tags_checked": False,
+        "tag_index": None,
+    }
+
+    def reload_config_if_changed():
+        # config.json が更新されていればルールを読み直す（不正な内容なら前のルールを使い続ける）
+        current_mtime = config_mtime(config_path)
+        if current_mtime == state['config_mtime']:
+            return
+        state['config_mtime'] = current_mtime
+        print(f"🔄 {config_path} changed, reloading rules")
+        config_valid, new_tag_map = validate_config_file(config_path)
+        if config_valid:
+            state['tag_rules'] = TagRuleEngine(new_tag_map, user_tz)
+            state['tags_checked'] = False
+        else:
+            print("⚠️  Warning: Keeping the previous rules until the config is fixed")
+
+    # プロジェクト一覧はメモリに保持し、再検証のタイミングで取り直す
+    project_cache = {}
+
+    def load_project_cache():
+        if not project_cache:
+            project_cache.update(fetch_project_catalog(workspace_id, auth_header, metadata_cache))
+        return project_cache
+
+    # Webhook で受け取ったエントリーの変更前タグは、受信開始時の実行IDにまとめて保存する
+    webhook_run = {
+        "run_id": new_run_id("-webhook"),
+        "token_key": hashlib.sha256(account['api_token'].encode()).hexdigest()[:16],
+        "workspace_id": str(workspace_id),
+        "timezone": account['timezone'],
+        "started_at": datetime.now(user_tz).isoformat()
+    }
+    # 定期処理と Webhook で同じ変更ログに書くので、ライターは1つだけ開く
+    log_writer = RunLogWriter(LOG_DIR)
+
+    def process_webhook_batch(batch):
+        reload_config_if_changed()
+        now_local = datetime.now(user_tz)
+        load_project_cache()
+        if not state['tags_checked']:
+            # ルールのタグをワークスペースのタグ一覧と照合する（設定を読み直したときも照合し直す）
+            tags_ready, state['tag_index'] = prepare_workspace_tags(
+                args, workspace_id, auth_header, sorted(state['tag_rules'].all_tags()), metadata_cache, concurrency
+            )
+            if not tags_ready:
+                print(f"⚠️  Skipping webhook batch of {len(batch)} entries until the tags are fixed")
+                return
+            state['tags_checked'] = True
+        entries_by_date = {}
+        for entry in map(TimeEntry.from_api, batch.values()):
+            if entry.start:
+                entries_by_date.setdefault(parse_entry_start(entry['start']).astimezone(user_tz).date(), []).append(entry)
+        if state['tag_rules'].uses_client and entries_by_date:
+            # Webhook の本文には client_name がないので、client ルールで判定できるよう付加情報付きで取り直す
+            fetched, failed_dates = fetch_time_entries_by_date(auth_header, user_tz, list(entries_by_date))
+            for target_date in list(entries_by_date):
+                if target_date in failed_dates:
+                    # 取り直せなかった日付のエントリーは次の差分同期に任せる
+                    print(f"⚠️  Leaving {len(entries_by_date.pop(target_date))} webhook entries on {target_date} "
+                          f"to the next sweep: {failed_dates[target_date]}")
+                    continue
+                fetched_by_id = {entry.id: entry for entry in fetched[target_date]}
+                entries_by_date[target_date] = [fetched_by_id[entry.id] for entry in entries_by_date[target_date]
+                                                if entry.id in fetched_by_id]
+        if mirror is not None:
+            mirror.store(workspace_id, entries_by_date, project_cache, replace_dates=False,
+                         user_key=webhook_run['token_key'])
+
+        pending_updates = []
+        for target_date, entries in entries_by_date.items():
+            for entry in entries:
+                if entry.tags:
+                    continue
+                if entry.project_id:
+                    project_name = resolve_project_name(workspace_id, auth_header, project_cache, entry.project_id,
+                                                        metadata_cache)
+                    if project_name is None:
+                        continue
+                else:
+                    project_name = None
+                matched_tags = match_tags(state['tag_rules'], state['tag_index'], entry, project_name)
+                if matched_tags is None:
+                    continue
+                pending_updates.append({"entry": entry, "project_name": project_name or NO_PROJECT_LABEL,
+                                        "tags": matched_tags, "target_date": target_date})
+
+        if args.dry_run:
+            for update in pending_updates:
+                print(f"🔍 [DRY RUN] {update['project_name']} -> {update['tags']}")
+            print(f"⚡ Webhook batch: {len(batch)} entries, {len(pending_updates)} would be tagged")
+            return
+
+        succeeded = failed = 0
+        for target_date in sorted({update['target_date'] for update in pending_updates}):
+            date_updates = [update for update in pending_updates if update['target_date'] == target_date]
+            results = apply_tag_updates(workspace_id, auth_header, target_date, date_updates, concurrency,
+                                        snapshot_store, webhook_run, mirror=mirror)
+            date_success, date_failed = log_update_results(log_writer, target_date, date_updates, results,
+                                                           now_local.isoformat(), source="webhook")
+            succeeded += date_success
+            failed += date_failed
+        for key, value in (('processed', len(pending_updates)), ('success', succeeded), ('failed', failed)):
+            get_metrics().increment(f'entries_{key}', value)
+        print(f"⚡ Webhook batch: {len(batch)} entries, {succeeded} tagged, {failed} failed")
+        if succeeded and not state.get('webhook_snapshot_announced'):
+            state['webhook_snapshot_announced'] = True
+            print(f"🗂️  Snapshots of webhook updates are saved as run {webhook_run['run_id']} "
+                  f"(revert with --undo {webhook_run['run_id']})")
+
+    last_validated_at = None
+    cycle = 0
+
+    if receiver is not None:
+        host, port = receiver.server_address[:2]
+        print(f"📡 Webhook receiver listening on http://{host}:{port}/")
+        print(f"👻 Reconciliation sweep every {args.interval:g}s (Ctrl-C or SIGTERM to stop)")
+    else:
+        print(f"👻 Daemon mode: polling every {args.interval:g}s (Ctrl-C or SIGTERM to stop)")
+    while not stop_event.is_set():
+        cycle += 1
+        cycle_started_at = time.time()
+        print(f"\n{'#'*50}")
+        print(f"🔁 Cycle {cycle} at {datetime.now(user_tz).strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"{'#'*50}")
+        reload_config_if_changed()
+
+        revalidate = last_validated_at is None or cycle_started_at - last_validated_at >= DAEMON_REVALIDATE_SECONDS
+        if revalidate:
+            project_cache.clear()
+
+        try:
+            result = process_account(
+                args, account, state['tag_rules'], metadata_cache, concurrency,
+                load_project_cache=load_project_cache,
+                snapshot_store=snapshot_store,
+                run_id=new_run_id(),
+                mirror=mirror,
+                revalidate=revalidate,
+                log_writer=log_writer
+            )
+        except Exception as e:
+            print(f"❌ Unexpected error: {e}")
+            result = {"status": "error", "error": str(e)}
+
+        if result['status'] == 'error':
+            # 認証情報が変わった可能性もあるので、次のサイクルで検証からやり直す
+            last_validated_at = None
+        elif revalidate:
+            last_validated_at = cycle_started_at
+
+        if metadata_cache is not None:
+            metadata_cache.save()
+        if args.metrics_file:
+            write_metrics_file(args.metrics_file, get_metrics().snapshot())
+
+        elapsed = time.time() - cycle_started_at
+        if stop_event.is_set():
+            break
+        print(f"💤 Cycle finished in {elapsed:.1f}s, next poll in {max(args.interval - elapsed, 0):.0f}s")
+        next_cycle_at = cycle_started_at + args.interval
+        if receiver is None:
+            stop_event.wait(max(next_cycle_at - time.time(), 0))
+            continue
+
+        # 次の差分同期まで、Webhook で届いたエントリーを随時処理する
+        while not stop_event.is_set() and time.time() < next_cycle_at:
+            batch = receiver.next_batch(timeout=min(1.0, max(next_cycle_at - time.time(), 0.01)))
+            if not batch:
+                continue
+            try:
+                process_webhook_batch(batch)
+            except Exception as e:
+                # 取りこぼしは次の差分同期で拾うので、受信は止めない
+                print(f"❌ Unexpected error while processing webhook batch: {e}")
+
+    if receiver is not None:
+        receiver.shutdown()
+        receiver.server_close()
+        print(f"📡 Webhook events: {receiver.counts['accepted']} accepted, {receiver.counts['ignored']} ignored, "
+              f"{receiver.counts['rejected']} rejected, {receiver.counts['dropped']} dropped")
+    log_writer.close()
+    print(f"👋 Daemon stopped after {cycle} cycles")
+    return 0
+
+# report サブコマンドのデフォルトの集計期間（日数）
+DEFAULT_REPORT_DAYS = 365
+
+def format_hours(seconds):
+    return f"{seconds / 3600:.1f}h"
+
+def format_share(part, whole):
+    return f"{part / whole * 100:.1f}%" if whole else "-"
+
+def run_report(args, workspace_id, timezone):
+    """ローカルミラーからタグ付け統計レポートを表示する。戻り値は終了コード"""
+    try:
+        today = datetime.now(ZoneInfo(timezone)).date()
+    except Exception:
+        print(f"❌ Error: Invalid timezone '{timezone}'. Please check TIMEZONE in .env file.")
+        return 1
+    try:
+        to_date = datetime.strptime(args.to_date, "%Y-%m-%d").date() if args.to_date else today
+        from_date = (datetime.strptime(args.from_date, "%Y-%m-%d").date() if args.from_date
+                     else to_date - timedelta(days=DEFAULT_REPORT_DAYS - 1))
+    except ValueError:
+        print(f"❌ Error: 日付は YYYY-MM-DD 形式で指定してください (例: 2025-07-01)")
+        return 1
+    if from_date > to_date:
+        print("❌ Error: --from は --to 以前の日付を指定してください")
+        return 1
+    if args.top < 1:
+        print("❌ Error: --top は1以上の数値を指定してください")
+        return 1
+
+    if not os.path.exists(MIRROR_DB_PATH):
+        print(f"❌ Error: Local mirror {MIRROR_DB_PATH} not found")
+        print("   💡 Hint: Run python main.py --days N --dry-run first to fetch entries")
+        return 1
+
+    mirror = EntryMirror()
+    started = time.perf_counter()
+    report = mirror.aggregate(from_date, to_date, args.period, args.top, workspace_id)
+    mirrored_from, mirrored_to = mirror.date_range(workspace_id)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    mirror.close()
+
+    total = report['total_seconds']
+    tagged = report['tagged_seconds']
+    print(f"\n{'='*50}")
+    print(f"📊 Report: {from_date} → {to_date}" + (f" (workspace {workspace_id})" if workspace_id else ""))
+    print(f"{'='*50}")
+    print(f"   Mirrored entries: {mirrored_from or '-'} → {mirrored_to or '-'}")
+    print(f"   Entries: {report['entries']}")
+    print(f"   Total time: {format_hours(total)}")
+    print(f"   Tagged time: {format_hours(tagged)} ({format_share(tagged, total)})")
+    print(f"   Untagged time: {format_hours(total - tagged)} ({format_share(total - tagged, total)})")
+
+    print(f"\n📁 Time by project (top {args.top}):")
+    for row in report['by_project']:
+        print(f"   {row['project']:<32} {format_hours(row['seconds']):>9}  tagged {format_share(row['tagged_seconds'], row['seconds']):>6}")
+
+    print(f"\n🏷️  Time by tag (top {args.top}):")
+    for row in report['by_tag']:
+        print(f"   {row['tag']:<32} {format_hours(row['seconds']):>9}  {format_share(row['seconds'], total):>6}")
+
+    print(f"\n📈 Tagging coverage by {args.period}:")
+    for row in report['by_period']:
+        share = row['tagged_seconds'] / row['seconds'] if row['seconds'] else 0
+        bar = '█' * round(share * 20)
+        print(f"   {row['period']:<10} {format_hours(row['seconds']):>9}  {format_share(row['tagged_seconds'], row['seconds']):>6}  {bar}")
+
+    print(f"\n⚡ Computed from local mirror in {elapsed_ms:.0f} ms (no API calls)")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                "from": str(from_date),
+                "to": str(to_date),
+                "period": args.period,
+                "workspace_id": workspace_id,
+                **report
+            }, f, indent=2, ensure_ascii=False)
+        print(f"📝 Report saved to: {args.json}")
+    return 0
+
+# --profile 使用時のメトリクスのデフォルト保存先
+DEFAULT_METRICS_PATH = os.path.join(LOG_DIR, "metrics.json")
+
+# Prometheus textfile のメトリクス名の接頭辞
+METRICS_PREFIX = "toggl_tag_fixer"
+
+def print_profile(metrics):
+    """フェーズ・HTTP呼び出しごとの所要時間の内訳を表示する"""
+    wall_seconds = metrics['wall_seconds']
+    counters = metrics['counters']
+    print(f"\n{'='*72}")
+    print(f"⏱️  Profile (wall time {wall_seconds:.2f}s)")
+    print(f"{'='*72}")
+    print(f"   {'Phase':<28} {'Calls':>7} {'Total s':>9} {'Avg ms':>9} {'Max ms':>9} {'Share':>7}")
+    for name, stats in sorted(metrics['phases'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+        print(f"   {name:<28} {stats['count']:>7} {stats['seconds']:>9.2f} "
+              f"{stats['seconds'] / stats['count'] * 1000:>9.1f} {stats['max_seconds'] * 1000:>9.1f} "
+              f"{format_share(stats['seconds'], wall_seconds):>7}")
+
+    print()
+    print(f"   {'HTTP endpoint':<44} {'Calls':>7} {'Total s':>9} {'Avg ms':>9} {'Max ms':>9}")
+    for name, stats in sorted(metrics['http'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+        print(f"   {name:<44} {stats['count']:>7} {stats['seconds']:>9.2f} "
+              f"{stats['seconds'] / stats['count'] * 1000:>9.1f} {stats['max_seconds'] * 1000:>9.1f}")
+        statuses = ', '.join(f"{status}×{count}" for status, count in sorted(stats['statuses'].items()))
+        print(f"   {'':<44} {statuses}")
+
+    print()
+    print(f"   Retries (5xx/network): {counters.get('retries', 0)}, backoff {counters.get('backoff_seconds', 0):.1f}s")
+    print(f"   Rate limiting: {counters['rate_limited_responses']} rate-limited responses, "
+          f"throttled {counters['throttled_seconds']:.1f}s")
+    print(f"   Project cache: {counters.get('project_cache_hits', 0)} hits, {counters.get('project_cache_misses', 0)} misses")
+    print(f"   Metadata cache: {counters.get('metadata_cache_hits', 0)} hits, "
+          f"{counters.get('metadata_cache_misses', 0)} misses")
+
+def format_prometheus_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+def write_metrics_file(path, metrics):
+    """メトリクスをJSON、または拡張子が .prom なら Prometheus textfile 形式で保存する"""
+    if not path.endswith('.prom'):
+        write_json_atomic(path, metrics)
+        return
+
+    lines = []
+
+    def add(name, help_text, metric_type, samples):
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} {metric_type}")
+        for labels, value in samples:
+            label_text = f"{{{format_prometheus_labels(labels)}}}" if labels else ""
+            lines.append(f"{METRICS_PREFIX}_{name}{label_text} {value}")
+
+    counters = metrics['counters']
+    add("last_run_timestamp_seconds", "Start time of the last run.", "gauge", [({}, metrics['started_at'])])
+    add("run_duration_seconds", "Wall time of the last run.", "gauge", [({}, metrics['wall_seconds'])])
+    add("phase_seconds", "Time spent in each phase.", "gauge",
+        [({"phase": name}, stats['seconds']) for name, stats in metrics['phases'].items()])
+    add("phase_calls", "Number of times each phase ran.", "gauge",
+        [({"phase": name}, stats['count']) for name, stats in metrics['phases'].items()])
+    add("http_request_seconds", "Time spent in HTTP requests per endpoint.", "gauge",
+        [({"endpoint": name}, stats['seconds']) for name, stats in metrics['http'].items()])
+    add("http_requests", "HTTP requests per endpoint and status.", "gauge", [
+        ({"endpoint": name, "status": status}, count)
+        for name, stats in metrics['http'].items()
+        for status, count in stats['statuses'].items()
+    ])
+    add("retries", "Retries after server or network errors.", "gauge", [({}, counters.get('retries', 0))])
+    add("backoff_seconds", "Time spent sleeping before retries.", "gauge", [({}, counters.get('backoff_seconds', 0))])
+    add("throttled_seconds", "Time spent waiting for the rate limiter.", "gauge", [({}, counters['throttled_seconds'])])
+    add("rate_limited_responses", "429 responses received.", "gauge", [({}, counters['rate_limited_responses'])])
+    add("cache_requests", "Cache lookups by cache and result.", "gauge", [
+        ({"cache": cache, "result": result}, counters.get(f"{cache}_cache_{result}", 0))
+        for cache in ("project", "metadata")
+        for result in ("hits", "misses")
+    ])
+    add("entries", "Entries processed by result.", "gauge", [
+        ({"result": result}, counters.get(f"entries_{result}", 0))
+        for result in ("processed", "success", "failed")
+    ])
+
+    # textfile collector が書き込み途中のファイルを読まないよう、置き換えで保存する
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+def main():
+    """メイン処理"""
+    args = parse_arguments()
+    
+    load_dotenv()
+    configure_api_base_url()
+    
+    API_TOKEN = os.getenv('TOGGL_API_TOKEN')
+    WORKSPACE_ID = os.getenv('WORKSPACE_ID')
+    TIMEZONE = os.getenv('TIMEZONE', 'Asia/Tokyo')  # デフォルトは日本時間
+    
+    if args.command == 'report':
+        # レポートはローカルミラーだけで作成するので、APIトークンは不要
+        exit(run_report(args, WORKSPACE_ID, TIMEZONE))
+    
+    if not args.fleet and (not API_TOKEN or not WORKSPACE_ID):
+        print("❌ Error: TOGGL_API_TOKEN and WORKSPACE_ID must be set in .env file")
+        exit(1)
+    
+    # タイムゾーンの検証
+    try:
+        user_tz = ZoneInfo(TIMEZONE)
+    except Exception as e:
+        print(f"❌ Error: Invalid timezone '{TIMEZONE}'. Please check TIMEZONE in .env file.")
+        print(f"   Common timezones: Asia/Tokyo, America/New_York, Europe/London, UTC")
+        exit(1)
+    
+    # 日付オプションの検証
+    if args.date:
+        try:
+            datetime.strptime(args.date, "%Y-%m-%d")
+        except ValueError:
+            print(f"❌ Error: 日付は YYYY-MM-DD 形式で指定してください (例: 2025-07-01)")
+            exit(1)
+    if args.days is not None and args.days < 1:
+        print(f"❌ Error: --days は1以上の数値を指定してください")
+        exit(1)
+    
+    # config.jsonの検証
+    config_valid, PROJECT_TAG_MAP = validate_config_file('config.json')
+    if not config_valid:
+        exit(1)
+
+    # 並行数の決定と共有HTTPセッションの準備
+    if args.concurrency < 1:
+        print("❌ Error: --concurrency は1以上の数値を指定してください")
+        exit(1)
+    concurrency = args.concurrency if args.async_mode else 1
+    if args.rate_limit < 0:
+        print("❌ Error: --rate-limit は0以上の数値を指定してください")
+        exit(1)
+    configure_rate_limiter(args.rate_limit)
+
+    # 永続キャッシュの準備
+    metadata_cache = None if args.no_cache else MetadataCache(METADATA_CACHE_PATH, refresh=args.refresh_cache)
+
+    # 変更前のタグのスナップショット（dry-run では何も変更しないので保存しない）
+    if args.undo and args.interactive:
+        print("❌ Error: --undo と --interactive は同時に使用できません")
+        exit(1)
+    run_id = new_run_id()
+    snapshot_store = SnapshotStore() if args.undo or not args.dry_run else None
+
+    # 取得したエントリーのローカルミラー（report サブコマンド用）
+    mirror = EntryMirror()
+
+    if args.daemon or args.webhook:
+        # 常駐モード: 差分同期を一定間隔で繰り返す（Webhook受信時はその合間にイベントを処理する）
+        if args.fleet or args.interactive or args.date or args.today or args.days or args.resume or args.undo:
+            print("❌ Error: --daemon / --webhook は --fleet・--interactive・日付指定・--resume・--undo と同時に使用できません")
+            exit(1)
+        if args.interval is None:
+            args.interval = DEFAULT_RECONCILE_INTERVAL if args.webhook else DEFAULT_DAEMON_INTERVAL
+        if args.interval <= 0:
+            print("❌ Error: --interval は0より大きい数値を指定してください")
+            exit(1)
+        args.incremental = True
+        configure_http_session(pool_size=concurrency)
+        account = {"name": "default", "api_token": API_TOKEN, "workspace_id": WORKSPACE_ID, "timezone": TIMEZONE}
+
+        receiver = None
+        if args.webhook:
+            webhook_secret = os.getenv('TOGGL_WEBHOOK_SECRET')
+            if not webhook_secret:
+                print("❌ Error: TOGGL_WEBHOOK_SECRET must be set in .env file to verify webhook signatures")
+                exit(1)
+            # 自分のエントリーのイベントだけを処理するため、APIトークンのユーザーIDを確認する
+            try:
+                user_id = fetch_current_user_id(build_auth_header(API_TOKEN), metadata_cache,
+                                                hashlib.sha256(API_TOKEN.encode()).hexdigest()[:16])
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Error: Network error fetching the API token's user: {e}")
+                exit(1)
+            if user_id is None:
+                print("❌ Error: Could not fetch the API token's user ID")
+                print("   💡 Hint: Check TOGGL_API_TOKEN in .env file")
+                exit(1)
+            try:
+                receiver = WebhookReceiver((args.webhook_host, args.webhook_port), webhook_secret, WORKSPACE_ID,
+                                           user_id)
+            except OSError as e:
+                print(f"❌ Error: Cannot listen on {args.webhook_host}:{args.webhook_port}: {e}")
+                exit(1)
+            receiver.start_in_background()
+
+        exit_code = run_daemon(args, account, 'config.json', PROJECT_TAG_MAP, metadata_cache, concurrency,
+                               snapshot_store, mirror, receiver)
+    elif args.fleet:
+        # フリートモード: マニフェストの全ユーザーをワーカープールで処理する
+        if args.interactive:
+            print("❌ Error: --fleet と --interactive は同時に使用できません")
+            exit(1)
+        if args.workers < 1:
+            print("❌ Error: --workers は1以上の数値を指定してください")
+            exit(1)
+        accounts = load_fleet_manifest(args.fleet, TIMEZONE)
+        if accounts is None:
+            exit(1)
+        configure_http_session(pool_size=concurrency * args.workers)
+        exit_code = run_fleet(args, accounts, PROJECT_TAG_MAP, metadata_cache, concurrency, snapshot_store, run_id,
+                              mirror)
+    else:
+        configure_http_session(pool_size=concurrency)
+        # タグ判定ルールを起動時に一度だけコンパイルする
+        tag_rules = TagRuleEngine(PROJECT_TAG_MAP, user_tz)
+        account = {"name": "default", "api_token": API_TOKEN, "workspace_id": WORKSPACE_ID, "timezone": TIMEZONE}
+        result = process_account(args, account, tag_rules, metadata_cache, concurrency,
+                                 snapshot_store=snapshot_store, run_id=run_id, mirror=mirror)
+        exit_code = 1 if result['status'] == 'error' else 0
+
+    # レート制限による待機時間の表示
+    throttled_seconds, rate_limited_count = rate_limit_totals()
+    if throttled_seconds >= 0.1 or rate_limited_count:
+        print(f"⏱️  Rate limiting: throttled {throttled_seconds:.1f}s, {rate_limited_count} rate-limited responses")
+
+    # 計測結果の表示と保存
+    if args.profile or args.metrics_file:
+        metrics = get_metrics().snapshot()
+        if args.profile:
+            print_profile(metrics)
+        metrics_path = args.metrics_file or DEFAULT_METRICS_PATH
+        write_metrics_file(metrics_path, metrics)
+        print(f"📝 Metrics saved to: {metrics_path}")
+
+    if metadata_cache is not None:
+        metadata_cache.save()
+    if snapshot_store is not None:
+        snapshot_store.close()
+    mirror.close()
+
+    if exit_code:
+        exit(exit_code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
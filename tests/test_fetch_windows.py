@@ -0,0 +1,71 @@
+"""split_fetch_windows と iter_time_entry_windows の期間分割のテスト"""
+import os
+import sys
+from datetime import date, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import MAX_FETCH_WINDOW_DAYS, split_fetch_windows  # noqa: E402
+
+
+def span_days(window):
+    return (max(window) - min(window)).days + 1
+
+
+def test_consecutive_dates_fill_whole_windows():
+    dates = [date(2025, 1, 1) + timedelta(days=i) for i in range(70)]
+    windows = split_fetch_windows(dates)
+    assert [len(window) for window in windows] == [31, 31, 8]
+    assert [d for window in windows for d in window] == dates
+
+
+def test_sparse_dates_are_split_by_calendar_span():
+    dates = [date(2025, 1, 1) + timedelta(days=10 * i) for i in range(37)]
+    windows = split_fetch_windows(dates)
+    assert all(span_days(window) <= MAX_FETCH_WINDOW_DAYS for window in windows)
+    assert [len(window) for window in windows] == [4] * 9 + [1]
+    assert [d for window in windows for d in window] == dates
+
+
+def test_descending_dates_keep_their_order():
+    today = date(2025, 7, 1)
+    dates = [today - timedelta(days=i) for i in range(40)]
+    windows = split_fetch_windows(dates)
+    assert windows[0][0] == today
+    assert all(span_days(window) <= MAX_FETCH_WINDOW_DAYS for window in windows)
+    assert [d for window in windows for d in window] == dates
+
+
+def test_empty():
+    assert split_fetch_windows([]) == []
+
+
+def test_each_request_stays_within_limit(monkeypatch):
+    requests_made = []
+
+    class EmptyResponse:
+        status_code = 200
+        encoding = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def iter_content(self, chunk_size):
+            yield b'[]'
+
+    def fake_request(method, url, auth_header, params=None, **kwargs):
+        requests_made.append(params)
+        return EmptyResponse()
+
+    monkeypatch.setattr(main, 'make_request_with_retry', fake_request)
+    dates = [date(2025, 1, 1) + timedelta(days=10 * i) for i in range(37)]
+    list(main.iter_time_entry_windows({}, timezone.utc, dates))
+    assert len(requests_made) == 10
+    for params in requests_made:
+        start = date.fromisoformat(params['start_date'][:10])
+        end = date.fromisoformat(params['end_date'][:10])
+        assert (end - start).days + 1 <= MAX_FETCH_WINDOW_DAYS
@@ -0,0 +1,104 @@
+"""--resume のテスト（ローカルの Toggl API スタンドインに対して main.py を実行する）"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'bench'))
+
+from fake_toggl_server import SAMPLE_TAGS, WORKSPACE_ID, add_server_arguments, create_server  # noqa: E402
+from main import CheckpointJournal  # noqa: E402
+
+API_TOKEN = 'resume-test-token'
+RUN_ID = '20250701-090000-abc123'
+
+
+@pytest.fixture
+def server():
+    parser = argparse.ArgumentParser()
+    add_server_arguments(parser)
+    server = create_server(parser.parse_args(['--entries', '300', '--days', '3', '--seed', '1']))
+    server.start_in_background()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_main(work_dir, base_url, *args):
+    env = dict(os.environ)
+    env.update({
+        'TOGGL_API_TOKEN': API_TOKEN,
+        'WORKSPACE_ID': str(WORKSPACE_ID),
+        'TIMEZONE': 'UTC',
+        'TOGGL_API_BASE_URL': base_url,
+    })
+    return subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'main.py'), '--rate-limit', '0', '--no-cache',
+                           *args], cwd=work_dir, env=env, capture_output=True, text=True, timeout=60)
+
+
+def untagged_entry_ids(dataset, target_date):
+    return [
+        entry['id'] for entry in map(dataset.entry, range(1, len(dataset) + 1))
+        if entry['project_id'] and not entry['tags'] and entry['start'].startswith(str(target_date))
+    ]
+
+
+def test_resume_sends_only_unapplied_planned_updates_under_the_original_run(server, tmp_path):
+    dataset = server.dataset
+    target_date = datetime.fromtimestamp(dataset.starts[len(dataset) // 2], timezone.utc).date()
+    untagged = untagged_entry_ids(dataset, target_date)
+    assert len(untagged) > 4
+    applied_id, planned_ids, unplanned_ids = untagged[0], untagged[1:3], untagged[3:]
+    planned_tag = SAMPLE_TAGS[0]
+
+    with open(tmp_path / 'config.json', 'w', encoding='utf-8') as f:
+        json.dump({name: [SAMPLE_TAGS[1]] for name in dataset.projects.values()}, f)
+
+    # 計画を記録し、1件目だけ適用したところで中断した実行のジャーナル
+    token_key = hashlib.sha256(API_TOKEN.encode()).hexdigest()[:16]
+    journal_path = tmp_path / 'cache' / 'checkpoints' / f'{token_key}_{WORKSPACE_ID}.jsonl'
+    journal_path.parent.mkdir(parents=True)
+    records = [{"type": "run", "run_id": RUN_ID, "started_at": "2025-07-01T09:00:00+00:00",
+                "dates": [str(target_date)]}]
+    records += [{"type": "planned", "target_date": str(target_date), "entry_id": entry_id, "tags": [planned_tag]}
+                for entry_id in [applied_id] + planned_ids]
+    records.append({"type": "applied", "entry_id": applied_id, "tags": [planned_tag]})
+    journal_path.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding='utf-8')
+
+    result = run_main(tmp_path, server.base_url, '--resume')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert f"Resuming run {RUN_ID}" in result.stdout
+
+    # 計画のうち未適用の更新だけが計画どおりのタグで送られ、計画外のエントリーには触れない
+    assert dataset.entry(applied_id)['tags'] == []
+    assert all(dataset.entry(entry_id)['tags'] == [planned_tag] for entry_id in planned_ids)
+    assert all(dataset.entry(entry_id)['tags'] == [] for entry_id in unplanned_ids)
+    assert not journal_path.exists()
+
+    # 再開した分も元の実行IDで取り消せる
+    result = run_main(tmp_path, server.base_url, '--undo', RUN_ID)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert all(dataset.entry(entry_id)['tags'] == [] for entry_id in planned_ids)
+
+
+def test_new_run_records_its_run_id(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = CheckpointJournal(path)
+    target_date = datetime(2025, 7, 1).date()
+    journal.start([target_date], "2025-07-01T09:00:00+00:00", RUN_ID)
+    journal.record_planned(target_date, [{"entry": {"id": 1}, "tags": ["a"]}, {"entry": {"id": 2}, "tags": ["b"]}])
+    journal.record_results([({"entry": {"id": 1}, "tags": ["a"]}, {"status": "success"}),
+                            ({"entry": {"id": 2}, "tags": ["b"]}, {"status": "network_error"})])
+
+    loaded = CheckpointJournal.load(path)
+    assert loaded.run_id == RUN_ID
+    assert loaded.planned_for(target_date) == {1: ["a"], 2: ["b"]}
+    assert loaded.is_applied(1, ["a"]) and not loaded.is_applied(2, ["b"])
+    assert loaded.pending_dates() == [target_date]
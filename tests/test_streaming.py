@@ -0,0 +1,131 @@
+"""iter_json_array と TimeEntry のテスト"""
+import json
+import os
+import sys
+from datetime import date, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import TimeEntry, iter_json_array  # noqa: E402
+
+
+class FakeResponse:
+    """iter_content でバイト列を決まった長さずつ返すだけのレスポンス"""
+
+    def __init__(self, body, encoding=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.encoding = encoding
+        self.status_code = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+def parse(body, chunk_size):
+    return list(iter_json_array(FakeResponse(body), chunk_size=chunk_size))
+
+
+ENTRIES = [
+    {"id": 1, "description": "say \"hi\" \\ [not, an] {array}", "tags": ["a,b", "]"]},
+    {"id": 2, "description": "line\nbreak\ttab é \\u0041", "tags": []},
+    {"id": 3, "description": "日本語のメモ 🍣", "project_id": None},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, 4096])
+def test_splits_inside_strings_and_escapes(chunk_size):
+    body = json.dumps(ENTRIES)
+    assert parse(body, chunk_size) == ENTRIES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3])
+def test_multibyte_utf8_split_across_chunks(chunk_size):
+    # ensure_ascii=False で日本語や絵文字をそのまま UTF-8 の複数バイトにする
+    body = json.dumps(ENTRIES, ensure_ascii=False)
+    assert parse(body, chunk_size) == ENTRIES
+
+
+@pytest.mark.parametrize("body", ["[]", " [ ] ", "[\n]\n", "null", " null\n"])
+def test_empty_bodies(body):
+    assert parse(body, 1) == []
+    assert parse(body, 64) == []
+
+
+def test_whitespace_between_elements():
+    body = '[ {"id": 1} ,\n {"id": 2}\r\n,{"id": 3} ]'
+    assert [item['id'] for item in parse(body, 4)] == [1, 2, 3]
+
+
+def test_uses_response_encoding():
+    body = json.dumps([{"description": "Café"}], ensure_ascii=False).encode('latin-1')
+    response = FakeResponse(body, encoding='latin-1')
+    assert list(iter_json_array(response, chunk_size=3)) == [{"description": "Café"}]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 8, 4096])
+def test_truncated_body_raises(chunk_size):
+    body = json.dumps(ENTRIES)
+    truncated = body[:body.index('"id": 3') + 4]
+    items = iter_json_array(FakeResponse(truncated), chunk_size=chunk_size)
+    # 切れる前の要素は返してから失敗する
+    assert next(items) == ENTRIES[0]
+    assert next(items) == ENTRIES[1]
+    with pytest.raises(json.JSONDecodeError):
+        next(items)
+
+
+@pytest.mark.parametrize("body", ['[{"id": 1}, {"id": 2}', '[{"id": 1},', '[{"id": 1}, ', '[', ''])
+@pytest.mark.parametrize("chunk_size", [1, 4096])
+def test_body_ending_before_closing_bracket_raises(body, chunk_size):
+    with pytest.raises(json.JSONDecodeError):
+        parse(body, chunk_size)
+
+
+@pytest.mark.parametrize("body", ['{"error": "x"}', '"text"', '42', 'true', 'nope', 'nul'])
+@pytest.mark.parametrize("chunk_size", [1, 4096])
+def test_non_array_body_raises(body, chunk_size):
+    with pytest.raises(json.JSONDecodeError):
+        parse(body, chunk_size)
+
+
+def test_time_entry_get_and_getitem():
+    entry = TimeEntry.from_api({
+        "id": 42, "project_id": 7, "tags": None, "description": None,
+        "start": "2025-07-01T09:00:00Z", "duration": None, "workspace_id": 1,
+    })
+    assert entry['id'] == 42
+    assert entry['project_id'] == 7
+    assert entry['tags'] == []
+    assert entry['duration'] == 0
+    # 値が None なら既定値を返す
+    assert entry.get('description', '') == ''
+    assert entry.get('client_name') is None
+    assert entry.get('start') == "2025-07-01T09:00:00Z"
+    # 持たないフィールドは get では既定値、[] では KeyError
+    assert entry.get('workspace_id', 'missing') == 'missing'
+    with pytest.raises(KeyError):
+        entry['workspace_id']
+
+
+@pytest.mark.parametrize("cut", [10, 1])
+def test_truncated_window_marks_dates_failed(monkeypatch, cut):
+    # 要素の途中で切れた場合と、閉じ括弧だけが欠けた場合
+    body = json.dumps([{"id": 1, "start": "2025-07-01T09:00:00Z"}, {"id": 2, "start": "2025-07-02T09:00:00Z"}])
+    monkeypatch.setattr(main, 'make_request_with_retry', lambda *args, **kwargs: FakeResponse(body[:-cut]))
+    dates = [date(2025, 7, 1), date(2025, 7, 2)]
+    windows = list(main.iter_time_entry_windows({}, timezone.utc, dates))
+    assert len(windows) == 1
+    entries_by_date, failed_dates = windows[0]
+    assert set(failed_dates) == set(dates)
+    assert all(message.startswith("Invalid response:") for message in failed_dates.values())
+    assert entries_by_date == {target_date: [] for target_date in dates}
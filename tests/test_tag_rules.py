@@ -0,0 +1,123 @@
+"""TagRuleEngine と validate_rule のテスト"""
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TagRuleEngine, TimeEntry, validate_rule  # noqa: E402
+
+UTC = ZoneInfo('UTC')
+
+
+def make_entry(description='', start='2025-07-01T10:00:00Z', billable=False, client_name=None):
+    return TimeEntry(1, project_id=1, description=description, start=start, billable=billable,
+                     client_name=client_name)
+
+
+def test_exact_project_mapping():
+    engine = TagRuleEngine({"Development": ["dev"], "Meeting": ["meeting", "internal"]}, UTC)
+    assert engine.match(make_entry(), "Development") == ["dev"]
+    assert engine.match(make_entry(), "Meeting") == ["meeting", "internal"]
+    assert engine.match(make_entry(), "Other") is None
+
+
+def test_regex_candidates():
+    engine = TagRuleEngine({"rules": [
+        {"project_regex": "^Client ", "tags": ["client"]},
+        {"project_regex": "Support$", "tags": ["support"]},
+    ]}, UTC)
+    assert engine.match(make_entry(), "Client Support") == ["client", "support"]
+    assert engine.match(make_entry(), "Client A") == ["client"]
+    assert engine.match(make_entry(), "Internal") is None
+
+
+def test_unscoped_rules_apply_with_and_without_project():
+    engine = TagRuleEngine({
+        "Development": ["dev"],
+        "rules": [{"description_regex": "review", "tags": ["review"]}],
+    }, UTC)
+    assert engine.match(make_entry("code review"), "Development") == ["dev", "review"]
+    assert engine.match(make_entry("code review"), "Other") == ["review"]
+    assert engine.match(make_entry("code review"), None) == ["review"]
+    # プロジェクトのないエントリーには、プロジェクト条件のあるルールを使わない
+    assert engine.match(make_entry("planning"), None) is None
+
+
+def test_add_and_replace_follow_definition_order():
+    engine = TagRuleEngine({"rules": [
+        {"project": "Development", "tags": ["dev"]},
+        {"description_regex": "bug", "tags": ["bugfix", "dev"]},
+        {"billable": True, "tags": ["billable"], "mode": "replace"},
+        {"client": "ACME", "tags": ["acme"]},
+    ]}, UTC)
+    assert engine.match(make_entry("bug"), "Development") == ["dev", "bugfix"]
+    assert engine.match(make_entry("bug", billable=True), "Development") == ["billable"]
+    assert engine.match(make_entry("bug", billable=True, client_name="ACME"), "Development") == ["billable", "acme"]
+
+
+def test_plain_mappings_come_before_rules_regardless_of_key_order():
+    engine = TagRuleEngine({
+        "rules": [{"project_regex": "Dev", "tags": ["regex"], "mode": "replace"}],
+        "Development": ["dev"],
+    }, UTC)
+    assert engine.match(make_entry(), "Development") == ["regex"]
+
+
+@pytest.mark.parametrize("start, expected", [
+    ("2025-07-01T22:00:00Z", ["night"]),
+    ("2025-07-01T23:59:00Z", ["night"]),
+    ("2025-07-01T00:30:00Z", ["night"]),
+    ("2025-07-01T05:59:00Z", ["night"]),
+    ("2025-07-01T06:00:00Z", None),
+    ("2025-07-01T21:59:00Z", None),
+])
+def test_hours_wrapping_past_midnight(start, expected):
+    engine = TagRuleEngine({"rules": [{"hours": [22, 6], "tags": ["night"]}]}, UTC)
+    assert engine.match(make_entry(start=start), "Development") == expected
+
+
+def test_hours_use_user_timezone():
+    engine = TagRuleEngine({"rules": [{"hours": [9, 18], "tags": ["work"]}]}, ZoneInfo('Asia/Tokyo'))
+    # UTC 01:00 は東京の 10:00
+    assert engine.match(make_entry(start="2025-07-01T01:00:00Z"), "Development") == ["work"]
+    assert engine.match(make_entry(start="2025-07-01T10:00:00Z"), "Development") is None
+
+
+def test_regexes_that_cannot_be_combined_fall_back_to_one_by_one():
+    engine = TagRuleEngine({"rules": [
+        {"project_regex": "(?i)^client", "tags": ["client"]},
+        {"project_regex": "(?P<name>Support)", "tags": ["support"]},
+        {"project_regex": "(?P<name>Ops)", "tags": ["ops"]},
+    ]}, UTC)
+    assert engine.project_regex_any is None
+    assert engine.match(make_entry(), "CLIENT Support") == ["client", "support"]
+    assert engine.match(make_entry(), "Ops") == ["ops"]
+    assert engine.match(make_entry(), "Internal") is None
+
+
+def test_candidates_are_memoized_per_project():
+    engine = TagRuleEngine({"Development": ["dev"], "rules": [{"project_regex": "^Dev", "tags": ["d"]}]}, UTC)
+    assert engine.match(make_entry(), "Development") == ["dev", "d"]
+    assert engine.match(make_entry(), "Development") == ["dev", "d"]
+    assert list(engine._candidates_cache) == ["Development"]
+
+
+@pytest.mark.parametrize("rule", [
+    {"tags": ["x"]},
+    {"project": "A", "tags": []},
+    {"project": "A", "tags": ["x"], "mode": "merge"},
+    {"project_regex": "(", "tags": ["x"]},
+    {"billable": "yes", "tags": ["x"]},
+    {"hours": [True, 6], "tags": ["x"]},
+    {"hours": [22, 25], "tags": ["x"]},
+    {"project": "A", "tags": ["x"], "color": "red"},
+])
+def test_invalid_rules_are_rejected(rule):
+    assert validate_rule(rule) is not None
+
+
+def test_valid_rule():
+    assert validate_rule({"project": "Development", "hours": [22, 6], "tags": ["night"], "mode": "replace"}) is None